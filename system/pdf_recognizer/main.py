@@ -1,62 +1,244 @@
+import asyncio
+import json
 import os
 import tempfile
+import time
 import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
 
 import aiofiles
 import aiohttp
 from fastapi import FastAPI, HTTPException
-from marker.converters.pdf import PdfConverter
-from marker.models import create_model_dict
-from marker.output import text_from_rendered
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-app = FastAPI()
+from text_cache import text_cache, InFlight, Document, file_sha256
+from workers import conversion_pool, convert_pdf, count_pages
 
-converter = PdfConverter(artifact_dict=create_model_dict())
+PAGES_PER_JOB = int(os.getenv("PAGES_PER_JOB", 4))
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", 100 * 1024 ** 2))
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", 10))
+DOWNLOAD_READ_TIMEOUT = float(os.getenv("DOWNLOAD_READ_TIMEOUT", 60))
+DOWNLOAD_TOTAL_TIMEOUT = float(os.getenv("DOWNLOAD_TOTAL_TIMEOUT", 300))
+DOWNLOAD_POOL_SIZE_PER_HOST = int(os.getenv("DOWNLOAD_POOL_SIZE_PER_HOST", 4))
+# Через сколько секунд скачанный по url документ перепроверяется условным GET
+PDF_REVALIDATE_AFTER = int(os.getenv("PDF_REVALIDATE_AFTER", 24 * 60 * 60))
+
+session: aiohttp.ClientSession | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global session
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit_per_host=DOWNLOAD_POOL_SIZE_PER_HOST),
+        timeout=aiohttp.ClientTimeout(total=DOWNLOAD_TOTAL_TIMEOUT, sock_connect=DOWNLOAD_CONNECT_TIMEOUT, sock_read=DOWNLOAD_READ_TIMEOUT)
+    )
+    conversion_pool.start()
+    yield
+    conversion_pool.stop()
+    await session.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+in_flight = InFlight()
 
 
 class URLInput(BaseModel):
     url: str
+    # Страницы в формате marker, например "0-4,8" (нумерация с нуля)
+    page_range: Optional[str] = None
+    # Конвертация останавливается как только набрано столько символов
+    max_chars: Optional[int] = None
 
 
 class TextOutput(BaseModel):
     text: str
 
 
-async def download_pdf_async(url: str, temp_dir: str) -> str:
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status != 200:
-                    raise HTTPException(status_code=400, detail=f"Ошибка загрузки PDF: статус {response.status}")
-
-                content = await response.read()
+class BatchURLInput(BaseModel):
+    urls: list[str]
+    page_range: Optional[str] = None
+    max_chars: Optional[int] = None
 
-                file_path = os.path.join(temp_dir, f"{str(uuid.uuid4())}.pdf")
-                async with aiofiles.open(file_path, "wb") as f:
-                    await f.write(content)
 
-                return file_path
+async def download_pdf_async(url: str, temp_dir: str, etag: str | None = None, last_modified: str | None = None):
+    """Скачивает PDF потоково прямо в файл, не держа его целиком в памяти.
+    Возвращает (путь, etag, last_modified), а если переданы валидаторы и источник ответил 304, то путь None."""
+    headers = {}
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    if last_modified is not None:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and headers:
+                return None, etag, last_modified
+            if response.status != 200:
+                raise HTTPException(status_code=400, detail=f"Ошибка загрузки PDF: статус {response.status}")
+            if response.content_length is not None and response.content_length > PDF_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"PDF больше {PDF_MAX_BYTES} байт")
+
+            file_path = os.path.join(temp_dir, f"{str(uuid.uuid4())}.pdf")
+            size = 0
+            async with aiofiles.open(file_path, "wb") as f:
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > PDF_MAX_BYTES:
+                        raise HTTPException(status_code=413, detail=f"PDF больше {PDF_MAX_BYTES} байт")
+                    await f.write(chunk)
+
+            return file_path, response.headers.get("ETag"), response.headers.get("Last-Modified")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка загрузки PDF: {str(e)}")
 
 
+def parse_page_range(page_range: str | None, page_count: int) -> list[int]:
+    if page_range is None:
+        return list(range(page_count))
+    pages = set()
+    try:
+        for part in page_range.split(","):
+            if "-" in part:
+                start, end = part.split("-")
+                pages.update(range(int(start), int(end) + 1))
+            else:
+                pages.add(int(part))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Некорректный page_range: {page_range}")
+    return sorted(page for page in pages if 0 <= page < page_count)
+
+
+def chunk_pages(pages: list[int]) -> list[list[int]]:
+    """Делит страницы на куски подряд идущих страниц, выровненные по PAGES_PER_JOB.
+    Благодаря выравниванию куски переиспользуются из кэша между запросами с разными лимитами."""
+    chunks = []
+    for page in pages:
+        if chunks and chunks[-1][-1] == page - 1 and chunks[-1][0] // PAGES_PER_JOB == page // PAGES_PER_JOB:
+            chunks[-1].append(page)
+        else:
+            chunks.append([page])
+    return chunks
+
+
+async def download_document(url: str, cached: Document | None) -> tuple[str, int]:
+    with tempfile.TemporaryDirectory(dir=text_cache.store_dir) as temp_dir:
+        if cached is not None:
+            pdf_path, etag, last_modified = await download_pdf_async(url, temp_dir, cached.etag, cached.last_modified)
+            if pdf_path is None:
+                print(f"not modified url={url}")
+                await asyncio.to_thread(text_cache.touch_alias, url)
+                return cached.pdf_hash, cached.page_count
+        else:
+            pdf_path, etag, last_modified = await download_pdf_async(url, temp_dir)
+        pdf_hash = await asyncio.to_thread(file_sha256, pdf_path)
+        os.replace(pdf_path, text_cache.document_path(pdf_hash))
+
+    pdf_path = text_cache.document_path(pdf_hash)
+    page_count = await asyncio.to_thread(count_pages, pdf_path)
+    await asyncio.to_thread(text_cache.put_document, pdf_hash, page_count, os.path.getsize(pdf_path), url, etag, last_modified)
+    return pdf_hash, page_count
+
+
+async def open_document(url: str, need_file: bool) -> tuple[str, int]:
+    cached = await asyncio.to_thread(text_cache.get_document_by_url, url)
+    if cached is not None:
+        has_file = os.path.exists(text_cache.document_path(cached.pdf_hash))
+        if has_file or not need_file:
+            if time.time() - cached.validated_at < PDF_REVALIDATE_AFTER:
+                return cached.pdf_hash, cached.page_count
+            # Копия есть, но устарела: перепроверяем условным GET
+            return await in_flight.run(f"download:{url}", lambda: download_document(url, cached))
+    return await in_flight.run(f"download:{url}", lambda: download_document(url, None))
+
+
+async def convert_chunk(chunk_key: str, pdf_path: str, pages: list[int]) -> str:
+    text = await conversion_pool.submit(convert_pdf, pdf_path, pages)
+    await asyncio.to_thread(text_cache.put_chunk, chunk_key, text)
+    return text
+
+
+async def extract_pages(url: str, page_range: str | None = None, max_chars: int | None = None):
+    """Отдает (страницы, текст) по кускам страниц. Уже распознанные куски берутся из кэша,
+    а конвертация прекращается как только набран max_chars символов."""
+    pdf_hash, page_count = await open_document(url, need_file=False)
+    total_chars = 0
+    for pages in chunk_pages(parse_page_range(page_range, page_count)):
+        chunk_key = f"{pdf_hash}:{','.join(map(str, pages))}"
+        text = await asyncio.to_thread(text_cache.get_chunk, chunk_key)
+        if text is None:
+            conversion_pool.check_capacity()
+            pdf_hash, _ = await open_document(url, need_file=True)
+            chunk_key = f"{pdf_hash}:{','.join(map(str, pages))}"
+            pdf_path = text_cache.document_path(pdf_hash)
+            text = await in_flight.run(f"chunk:{chunk_key}", lambda: convert_chunk(chunk_key, pdf_path, pages))
+
+        yield pages, text
+        total_chars += len(text)
+        if max_chars is not None and total_chars >= max_chars:
+            break
+
+
+async def extract_text(url: str, page_range: str | None = None, max_chars: int | None = None) -> str:
+    print(f"processing url={url}")
+    texts = [text async for _, text in extract_pages(url, page_range, max_chars)]
+    print(f"done url={url} ")
+    text = "\n\n".join(texts)
+    return text[:max_chars] if max_chars is not None else text
+
+
 @app.post("/extract-text")
 async def extract_text_from_pdf(inp: URLInput) -> TextOutput:
-    with tempfile.TemporaryDirectory() as temp_dir:
+    try:
+        return TextOutput(text=await extract_text(inp.url, inp.page_range, inp.max_chars))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка обработки PDF: {str(e)}")
+
+
+@app.post("/extract-text/stream")
+async def stream_text_from_pdf(inp: URLInput) -> StreamingResponse:
+    """Отдает текст в NDJSON по мере конвертации кусков страниц.
+    Если клиент закрыл соединение, оставшиеся страницы не конвертируются."""
+    async def results():
         try:
-            print(f"processing url={inp.url}")
-            pdf_path = await download_pdf_async(inp.url, temp_dir)
-
-            rendered = converter(pdf_path)
-            text, _, _ = text_from_rendered(rendered)
-            print(f"done url={inp.url} ")
-            output = TextOutput(text=text)
-            return output
-        except HTTPException:
-            raise
+            async for pages, text in extract_pages(inp.url, inp.page_range, inp.max_chars):
+                yield json.dumps({"pages": pages, "text": text}, ensure_ascii=False) + "\n"
+        except HTTPException as e:
+            yield json.dumps({"error": e.detail, "status_code": e.status_code}, ensure_ascii=False) + "\n"
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Ошибка обработки PDF: {str(e)}")
+            yield json.dumps({"error": f"Ошибка обработки PDF: {str(e)}", "status_code": 500}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.post("/extract-text/batch")
+async def extract_text_from_pdfs(inp: BatchURLInput) -> StreamingResponse:
+    """Скачивает и конвертирует PDF параллельно и отдает результаты в NDJSON по мере готовности."""
+    async def extract(url):
+        try:
+            return {"url": url, "text": await extract_text(url, inp.page_range, inp.max_chars)}
+        except HTTPException as e:
+            return {"url": url, "error": e.detail, "status_code": e.status_code}
+        except Exception as e:
+            return {"url": url, "error": f"Ошибка обработки PDF: {str(e)}", "status_code": 500}
+
+    async def results():
+        tasks = [asyncio.create_task(extract(url)) for url in dict.fromkeys(inp.urls)]
+        try:
+            for result in asyncio.as_completed(tasks):
+                yield json.dumps(await result, ensure_ascii=False) + "\n"
+        finally:
+            # Клиент отключился или перестал ждать: незаконченные конвертации отменяются и освобождают воркеры
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+TEXT_CACHE_PATH = os.getenv("TEXT_CACHE_PATH", os.path.join(CACHE_DIR, "texts.sqlite"))
+TEXT_CACHE_MAX_BYTES = int(os.getenv("TEXT_CACHE_MAX_BYTES", 1024 ** 3))
+PDF_STORE_DIR = os.getenv("PDF_STORE_DIR", os.path.join(CACHE_DIR, "pdfs"))
+PDF_STORE_MAX_BYTES = int(os.getenv("PDF_STORE_MAX_BYTES", 5 * 1024 ** 3))
+# Недавно использованные PDF не вытесняются, так как их может читать воркер конвертации
+PDF_STORE_MIN_AGE = int(os.getenv("PDF_STORE_MIN_AGE", 60 * 60))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass
+class Document:
+    pdf_hash: str
+    page_count: int
+    etag: str | None
+    last_modified: str | None
+    validated_at: float
+
+
+class TextCache:
+    """Хранилище скачанных PDF (файлы по sha256 хэшу), распознанного текста по кускам страниц
+    и алиасов url -> хэш. Тексты и файлы вытесняются по давности использования
+    при превышении своих лимитов по размеру."""
+
+    def __init__(self, path: str, max_bytes: int, store_dir: str, store_max_bytes: int):
+        self.max_bytes = max_bytes
+        self.store_dir = store_dir
+        self.store_max_bytes = store_max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        os.makedirs(store_dir, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_accessed_at ON chunks(accessed_at);
+            CREATE TABLE IF NOT EXISTS documents (
+                pdf_hash TEXT PRIMARY KEY,
+                page_count INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS aliases (
+                url TEXT PRIMARY KEY,
+                pdf_hash TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+        """)
+        alias_columns = {row[1] for row in self._db.execute("PRAGMA table_info(aliases)").fetchall()}
+        for column in ("etag", "last_modified"):
+            if column not in alias_columns:
+                self._db.execute(f"ALTER TABLE aliases ADD COLUMN {column} TEXT")
+        self._db.commit()
+
+    def document_path(self, pdf_hash: str) -> str:
+        return os.path.join(self.store_dir, f"{pdf_hash}.pdf")
+
+    def get_chunk(self, chunk_key: str) -> str | None:
+        with self._lock:
+            row = self._db.execute("SELECT text FROM chunks WHERE chunk_key = ?", (chunk_key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE chunks SET accessed_at = ? WHERE chunk_key = ?", (time.time(), chunk_key))
+            self._db.commit()
+            return row[0]
+
+    def put_chunk(self, chunk_key: str, text: str):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO chunks(chunk_key, text, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (chunk_key, text, len(text.encode()), time.time())
+            )
+            self._evict_chunks()
+            self._db.commit()
+
+    def get_document_by_url(self, url: str) -> Document | None:
+        """Возвращает документ для уже скачанного url. Сам файл мог быть вытеснен."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT d.pdf_hash, d.page_count, a.etag, a.last_modified, a.created_at "
+                "FROM aliases a JOIN documents d ON d.pdf_hash = a.pdf_hash WHERE a.url = ?",
+                (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE documents SET accessed_at = ? WHERE pdf_hash = ?", (time.time(), row[0]))
+            self._db.commit()
+            return Document(*row)
+
+    def put_document(self, pdf_hash: str, page_count: int, size: int, url: str,
+                     etag: str | None = None, last_modified: str | None = None):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO documents(pdf_hash, page_count, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (pdf_hash, page_count, size, now)
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO aliases(url, pdf_hash, created_at, etag, last_modified) VALUES (?, ?, ?, ?, ?)",
+                (url, pdf_hash, now, etag, last_modified)
+            )
+            self._evict_documents()
+            self._db.commit()
+
+    def touch_alias(self, url: str):
+        """Источник ответил 304 Not Modified, документ по url считается снова актуальным."""
+        with self._lock:
+            self._db.execute("UPDATE aliases SET created_at = ? WHERE url = ?", (time.time(), url))
+            self._db.commit()
+
+    def _evict_chunks(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM chunks").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for chunk_key, size in self._db.execute("SELECT chunk_key, size FROM chunks ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM chunks WHERE chunk_key = ?", (chunk_key,))
+            total -= size
+
+    def _evict_documents(self):
+        # Запись о документе (хэш и число страниц) остается, удаляется только файл
+        total = sum(
+            size for pdf_hash, size in self._db.execute("SELECT pdf_hash, size FROM documents").fetchall()
+            if os.path.exists(self.document_path(pdf_hash))
+        )
+        if total <= self.store_max_bytes:
+            return
+        min_accessed_at = time.time() - PDF_STORE_MIN_AGE
+        for pdf_hash, size in self._db.execute(
+                "SELECT pdf_hash, size FROM documents WHERE accessed_at < ? ORDER BY accessed_at", (min_accessed_at,)
+        ).fetchall():
+            if total <= self.store_max_bytes:
+                break
+            path = self.document_path(pdf_hash)
+            if os.path.exists(path):
+                os.remove(path)
+                total -= size
+
+
+class InFlight:
+    """Схлопывает одновременные запросы с одинаковым ключом в одну задачу.
+    Задача защищена от отмены, чтобы отключение одного клиента не ломало остальным результат,
+    но отменяется, когда ее перестали ждать все запросы, чтобы не занимать воркер конвертации впустую."""
+
+    def __init__(self):
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+
+    async def run(self, key: str, factory: Callable[[], Awaitable]):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._tasks.pop(key) if self._tasks.get(key) is done else None)
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if self._waiters[key] == 0:
+                del self._waiters[key]
+
+
+text_cache = TextCache(TEXT_CACHE_PATH, TEXT_CACHE_MAX_BYTES, PDF_STORE_DIR, PDF_STORE_MAX_BYTES)
@@ -0,0 +1,135 @@
+import asyncio
+import multiprocessing
+import os
+from typing import Callable
+
+from fastapi import HTTPException
+
+CONVERSION_WORKERS = int(os.getenv("CONVERSION_WORKERS", 1))
+CONVERSION_QUEUE_SIZE = int(os.getenv("CONVERSION_QUEUE_SIZE", 16))
+CONVERSION_TIMEOUT = float(os.getenv("CONVERSION_TIMEOUT", 600))
+
+# Модели marker загружаются один раз в каждом процессе-воркере
+models = None
+
+
+def convert_pdf(pdf_path: str, page_range: list[int] | None = None) -> str:
+    from marker.converters.pdf import PdfConverter
+    from marker.output import text_from_rendered
+
+    config = {"page_range": page_range} if page_range is not None else {}
+    rendered = PdfConverter(artifact_dict=models, config=config)(pdf_path)
+    text, _, _ = text_from_rendered(rendered)
+    return text
+
+
+def count_pages(pdf_path: str) -> int:
+    import pypdfium2
+
+    document = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return len(document)
+    finally:
+        document.close()
+
+
+def _worker_main(conn):
+    global models
+    from marker.models import create_model_dict
+
+    models = create_model_dict()
+    while True:
+        try:
+            fn, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((True, fn(*args)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {str(e)}"))
+
+
+class Worker:
+    def __init__(self, ctx):
+        self._ctx = ctx
+        self._start()
+
+    def _start(self):
+        self._conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self._process.start()
+        child_conn.close()
+
+    def restart(self):
+        self.stop()
+        self._start()
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+        self._conn.close()
+
+    async def run(self, fn: Callable, args: tuple, timeout: float):
+        try:
+            self._conn.send((fn, args))
+            ok, result = await asyncio.wait_for(asyncio.to_thread(self._conn.recv), timeout)
+        except BaseException:
+            # Зависшую или упавшую конвертацию нельзя прервать изнутри, а при отмене (например, на остановке сервиса)
+            # поток все еще ждет ответа и следующая задача получила бы чужой результат,
+            # поэтому при любом незавершенном ожидании процесс перезапускается до возврата воркера в пул
+            self.restart()
+            raise
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+
+class ConversionPool:
+    """Пул процессов для конвертации PDF с ограниченной очередью.
+    Если очередь заполнена, запрос сразу отклоняется с 429 вместо того чтобы ждать."""
+
+    def __init__(self, workers: int, queue_size: int, timeout: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.pending = 0
+        self._idle: asyncio.Queue | None = None
+        self._all: list[Worker] = []
+
+    def start(self):
+        ctx = multiprocessing.get_context("spawn")
+        self._idle = asyncio.Queue()
+        for _ in range(self.workers):
+            worker = Worker(ctx)
+            self._all.append(worker)
+            self._idle.put_nowait(worker)
+
+    def stop(self):
+        for worker in self._all:
+            worker.stop()
+        self._all = []
+
+    def check_capacity(self):
+        if self.pending >= self.workers + self.queue_size:
+            raise HTTPException(
+                status_code=429,
+                detail={"message": "Очередь конвертации переполнена", "queue_position": self.pending - self.workers + 1},
+                headers={"Retry-After": "30"}
+            )
+
+    async def submit(self, fn: Callable, *args):
+        self.check_capacity()
+        self.pending += 1
+        try:
+            worker = await self._idle.get()
+            try:
+                return await worker.run(fn, args, self.timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=504, detail=f"Конвертация PDF не уложилась в {self.timeout} секунд")
+            finally:
+                self._idle.put_nowait(worker)
+        finally:
+            self.pending -= 1
+
+
+conversion_pool = ConversionPool(CONVERSION_WORKERS, CONVERSION_QUEUE_SIZE, CONVERSION_TIMEOUT)
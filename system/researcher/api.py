@@ -0,0 +1,72 @@
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException
+from openai.types.responses import EasyInputMessageParam
+from pydantic import BaseModel
+
+import bootstrap
+from http_client import close_session
+from job_queue import job_queue, RunInProgressError
+from research import write_table_of_concepts
+from structured_outputs import ResearchRequest, TableOfConcepts
+
+API_PORT = int(os.getenv("API_PORT", 8001))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    bootstrap.configure()
+    yield
+    await close_session()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+class Message(BaseModel):
+    role: str
+    content: str
+
+
+class TableOfConceptsInput(BaseModel):
+    messages: list[Message]
+
+
+@app.post("/table-of-concepts")
+async def create_table_of_concepts(inp: TableOfConceptsInput) -> TableOfConcepts:
+    """Оглавление по диалогу с пользователем. Выполняется сразу, без очереди, так как это пара вызовов LLM."""
+    return await write_table_of_concepts([EasyInputMessageParam(role=message.role, content=message.content) for message in inp.messages])
+
+
+# Обработчики очереди синхронные: sqlite может ждать блокировку до 30 секунд, пока ее держат воркеры,
+# и FastAPI выполняет такие обработчики в пуле потоков, не блокируя event loop
+@app.post("/jobs")
+def create_job(inp: ResearchRequest) -> dict:
+    """Ставит исследование в очередь. Его выполнит один из воркеров (worker.py).
+    Задача с run_id, который уже в очереди или в работе, отклоняется с 409."""
+    try:
+        return job_queue.enqueue(inp.model_dump(mode='json'), inp.run_id).to_dict()
+    except RunInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/jobs")
+def list_jobs(status: Optional[str] = None, limit: int = 100) -> list[dict]:
+    return [job.to_dict() for job in job_queue.list(status, limit)]
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str) -> dict:
+    """Статус, прогресс, уже написанные главы и, когда задача завершена, итоговый текст или ошибка."""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задача {job_id} не найдена")
+    return job.to_dict()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=API_PORT)
@@ -0,0 +1,47 @@
+import asyncio
+import os
+
+from http_client import get_session, http_timeout
+from structured_outputs import ResearchRequest, TableOfConcepts
+
+RESEARCH_API_URL = os.getenv("RESEARCH_API_URL", "")
+RESEARCH_API_READ_TIMEOUT = float(os.getenv("RESEARCH_API_READ_TIMEOUT", 300))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 2))
+
+
+class ResearchApiClient:
+    """Клиент API исследований (api.py) для тонкого Gradio клиента и cli.py."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+
+    async def _request(self, method: str, path: str, **kwargs):
+        async with get_session().request(method, f"{self.base_url}{path}", timeout=http_timeout(read=RESEARCH_API_READ_TIMEOUT), **kwargs) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def table_of_concepts(self, messages: list[dict]) -> TableOfConcepts:
+        result = await self._request("POST", "/table-of-concepts", json={"messages": messages})
+        return TableOfConcepts.model_validate(result)
+
+    async def submit(self, request: ResearchRequest) -> dict:
+        return await self._request("POST", "/jobs", json=request.model_dump(mode='json'))
+
+    async def job(self, job_id: str) -> dict:
+        return await self._request("GET", f"/jobs/{job_id}")
+
+    async def jobs(self, status: str | None = None) -> list[dict]:
+        return await self._request("GET", "/jobs", params={"status": status} if status else None)
+
+    async def follow(self, job_id: str, poll_interval: float = JOB_POLL_INTERVAL):
+        """Опрашивает задачу и отдает ее состояние при каждом изменении, пока она не завершится."""
+        previous = None
+        while True:
+            job = await self.job(job_id)
+            state = (job['status'], len(job['chapters']), job['progress'], job['progress_desc'])
+            if state != previous:
+                previous = state
+                yield job
+            if job['status'] in ("done", "failed"):
+                return
+            await asyncio.sleep(poll_interval)
@@ -0,0 +1,173 @@
+import asyncio
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+import arxiv
+
+from resilience import call_with_retry
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+ARXIV_CACHE_PATH = os.getenv("ARXIV_CACHE_PATH", os.path.join(CACHE_DIR, "arxiv.sqlite"))
+ARXIV_CACHE_TTL = int(os.getenv("ARXIV_CACHE_TTL", 24 * 60 * 60))
+# arXiv просит не чаще одного запроса в 3 секунды
+ARXIV_DELAY_SECONDS = float(os.getenv("ARXIV_DELAY_SECONDS", 3))
+ARXIV_RATE_LIMIT_FILE = os.getenv("ARXIV_RATE_LIMIT_FILE", os.path.join(CACHE_DIR, "arxiv.lock"))
+
+
+@dataclass
+class ArxivPaper:
+    entry_id: str
+    title: str
+    pdf_url: str
+    summary: str
+
+
+class ArxivRateLimiter:
+    """Не чаще одного запроса в delay_seconds на все процессы машины.
+    Время последнего запроса хранится в файле под flock, так что лимит общий для Gradio, API и всех воркеров."""
+
+    def __init__(self, path: str, delay_seconds: float):
+        self.path = path
+        self.delay_seconds = delay_seconds
+        self._lock = asyncio.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def _call(self, request):
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                last = float(f.read() or 0)
+                wait = last + self.delay_seconds - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    return request()
+                finally:
+                    f.seek(0)
+                    f.truncate()
+                    f.write(str(time.time()))
+                    f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    async def call(self, request):
+        # asyncio.Lock держит в очереди корутины процесса, чтобы не занимать потоки ожиданием flock
+        async with self._lock:
+            return await asyncio.to_thread(self._call, request)
+
+
+class ArxivCache:
+    """Кэш поиска arxiv: запрос -> список id статей, id -> метаданные статьи.
+    Статья, найденная разными запросами, хранится один раз."""
+
+    def __init__(self, path: str, ttl: int):
+        self.ttl = ttl
+        self.counters = Counter(hits=0, misses=0)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS queries (
+                query TEXT PRIMARY KEY,
+                max_results INTEGER NOT NULL,
+                entry_ids TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS papers (
+                entry_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                pdf_url TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    def get(self, query: str, max_results: int) -> list[ArxivPaper] | None:
+        with self._lock:
+            row = self._db.execute("SELECT max_results, entry_ids, fetched_at FROM queries WHERE query = ?", (query,)).fetchone()
+            # Результат для большего max_results подходит и для меньшего, как и полностью исчерпанная выдача
+            if row is None or time.time() - row[2] > self.ttl or (row[0] < max_results and len(json.loads(row[1])) >= row[0]):
+                self.counters['misses'] += 1
+                return None
+            entry_ids = json.loads(row[1])[:max_results]
+            if len(entry_ids) == 0:
+                self.counters['hits'] += 1
+                return []
+            papers = {}
+            for entry_id, title, pdf_url, summary in self._db.execute(
+                f"SELECT entry_id, title, pdf_url, summary FROM papers WHERE entry_id IN ({','.join('?' * len(entry_ids))})", entry_ids
+            ):
+                papers[entry_id] = ArxivPaper(entry_id, title, pdf_url, summary)
+            if len(papers) < len(entry_ids):
+                self.counters['misses'] += 1
+                return None
+            self.counters['hits'] += 1
+            return [papers[entry_id] for entry_id in entry_ids]
+
+    def put(self, query: str, max_results: int, papers: list[ArxivPaper]):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO papers(entry_id, title, pdf_url, summary, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                [(paper.entry_id, paper.title, paper.pdf_url, paper.summary, now) for paper in papers]
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO queries(query, max_results, entry_ids, fetched_at) VALUES (?, ?, ?, ?)",
+                (query, max_results, json.dumps([paper.entry_id for paper in papers]), now)
+            )
+            self._db.execute("DELETE FROM queries WHERE fetched_at < ?", (now - self.ttl,))
+            self._db.execute("DELETE FROM papers WHERE fetched_at < ?", (now - self.ttl,))
+            self._db.commit()
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+arxiv_rate_limiter = ArxivRateLimiter(ARXIV_RATE_LIMIT_FILE, ARXIV_DELAY_SECONDS)
+arxiv_cache = ArxivCache(ARXIV_CACHE_PATH, ARXIV_CACHE_TTL)
+in_flight: dict[str, asyncio.Task] = {}
+
+
+def build_query(search_words: list[str]) -> str:
+    """Запрос по ключевым словам. Слова приводятся к нижнему регистру, без повторов и сортируются,
+    чтобы один и тот же набор слов от разных вопросов давал один ключ кэша."""
+    words = ' '.join(sorted({word.strip().lower() for word in search_words if word.strip()}))
+    return f'ti:{words} AND abs:{words}'
+
+
+def fetch(query: str, max_results: int) -> list[ArxivPaper]:
+    search = arxiv.Search(query=query, max_results=max_results, sort_by=arxiv.SortCriterion.Relevance)
+    # Одна страница на весь max_results, чтобы поиск был одним запросом.
+    # Собственные задержки клиента отключены, их заменяет arxiv_rate_limiter, а повторы делает call_with_retry
+    results = arxiv.Client(page_size=max(max_results, 1), delay_seconds=0, num_retries=0).results(search)
+    return [ArxivPaper(result.entry_id, result.title, result.pdf_url, result.summary) for result in results]
+
+
+async def search_arxiv(search_words: list[str], max_results: int) -> list[ArxivPaper]:
+    """Поиск в arxiv без блокировки event loop: сначала кэш, затем запрос в отдельном потоке с общим лимитом частоты.
+    Одинаковые запросы, идущие одновременно, выполняются один раз."""
+    query = build_query(search_words)
+    cached = await asyncio.to_thread(arxiv_cache.get, query, max_results)
+    if cached is not None:
+        return cached
+
+    key = f"{query}:{max_results}"
+    if key not in in_flight:
+        async def load():
+            papers = await call_with_retry("arxiv", lambda: arxiv_rate_limiter.call(lambda: fetch(query, max_results)))
+            await asyncio.to_thread(arxiv_cache.put, query, max_results, papers)
+            return papers
+
+        task = asyncio.create_task(load())
+        in_flight[key] = task
+        task.add_done_callback(lambda _: in_flight.pop(key, None))
+    return await asyncio.shield(in_flight[key])
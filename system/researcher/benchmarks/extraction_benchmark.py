@@ -0,0 +1,83 @@
+"""Сравнение объема markdown, который уходит в LLM, до и после выделения основного контента страницы.
+
+Сохранить корпус страниц (по одному url в строке):
+    python benchmarks/extraction_benchmark.py corpus/ --fetch urls.txt
+Посчитать сокращение на сохраненном корпусе:
+    python benchmarks/extraction_benchmark.py corpus/
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+
+from markdownify import markdownify
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extraction import html_to_markdown
+from http_client import get_session, close_session
+from relevance import estimate_tokens, CHARS_PER_TOKEN
+
+INDEX_FILE = "index.tsv"
+
+
+def baseline_markdown(html: str) -> str:
+    return re.sub(r"\n{3,}", "\n\n", markdownify(html).strip())
+
+
+async def fetch_corpus(corpus_dir: str, urls_file: str):
+    os.makedirs(corpus_dir, exist_ok=True)
+    with open(urls_file) as f:
+        urls = [line.strip() for line in f if line.strip()]
+
+    index = []
+    for i, url in enumerate(urls):
+        try:
+            async with get_session().get(url) as response:
+                response.raise_for_status()
+                html = await response.text(errors='replace')
+        except Exception as e:
+            print(f"skip {url}: {str(e)}")
+            continue
+        file_name = f"{i:04d}.html"
+        with open(os.path.join(corpus_dir, file_name), "w") as f:
+            f.write(html)
+        index.append(f"{file_name}\t{url}")
+    await close_session()
+
+    with open(os.path.join(corpus_dir, INDEX_FILE), "w") as f:
+        f.write("\n".join(index) + "\n")
+    print(f"saved {len(index)} pages to {corpus_dir}")
+
+
+def run_benchmark(corpus_dir: str):
+    with open(os.path.join(corpus_dir, INDEX_FILE)) as f:
+        pages = [line.rstrip("\n").split("\t") for line in f if line.strip()]
+
+    total_before = total_after = 0
+    print(f"{'page':<10} {'chars before':>14} {'chars after':>12} {'tokens before':>14} {'tokens after':>13} {'reduction':>10}  url")
+    for file_name, url in pages:
+        with open(os.path.join(corpus_dir, file_name)) as f:
+            html = f.read()
+        before = baseline_markdown(html)
+        after = html_to_markdown(html, url)
+        total_before += len(before)
+        total_after += len(after)
+        reduction = 1 - len(after) / len(before) if len(before) > 0 else 0.0
+        print(f"{file_name:<10} {len(before):>14} {len(after):>12} {estimate_tokens(before):>14} {estimate_tokens(after):>13} {reduction:>10.1%}  {url}")
+
+    if total_before > 0:
+        print(f"\ntotal: {total_before} -> {total_after} chars, "
+              f"~{total_before // CHARS_PER_TOKEN} -> ~{total_after // CHARS_PER_TOKEN} tokens, reduction {1 - total_after / total_before:.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus_dir")
+    parser.add_argument("--fetch", metavar="URLS_FILE", help="скачать страницы из файла в корпус")
+    args = parser.parse_args()
+    if args.fetch:
+        asyncio.run(fetch_corpus(args.corpus_dir, args.fetch))
+    else:
+        run_benchmark(args.corpus_dir)
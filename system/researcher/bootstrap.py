@@ -0,0 +1,38 @@
+import os
+import ssl
+
+from agents import set_default_openai_client, set_default_openai_api, set_trace_processors
+from agents.models import openai_provider
+from openai import AsyncOpenAI
+from phoenix.otel import register
+
+PHOENIX_TRACE_URL = os.getenv("PHOENIX_TRACE_URL", "http://localhost:6006/v1/traces")
+PHOENIX_PROJECT_NAME = os.getenv("PHOENIX_PROJECT_NAME", "deep-research")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY",  "1")
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://openrouter.ai/api/v1")
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "openai/gpt-4.1-mini")
+
+configured = False
+
+
+def configure():
+    """Настройка клиента OpenAI и трассировки в Phoenix. Вызывается один раз в каждом процессе,
+    который делает вызовы LLM: в Gradio, в API и в каждом воркере."""
+    global configured
+    if configured:
+        return
+    configured = True
+
+    ssl._create_default_https_context = ssl._create_unverified_context
+
+    # configure the Phoenix tracer
+    set_trace_processors([])
+    register(
+        project_name=PHOENIX_PROJECT_NAME,  # Default is 'default'
+        endpoint=PHOENIX_TRACE_URL,
+        auto_instrument=True
+    )
+
+    set_default_openai_client(AsyncOpenAI(base_url=OPENAI_API_URL, api_key=OPENAI_API_KEY, timeout=60 * 5))
+    set_default_openai_api('chat_completions')
+    openai_provider.DEFAULT_MODEL = DEFAULT_MODEL
@@ -0,0 +1,55 @@
+import json
+import os
+from contextvars import ContextVar
+
+from agents import Usage
+
+# Лимиты на одно исследование, 0 означает без ограничений
+RUN_TOKEN_BUDGET = int(os.getenv("RUN_TOKEN_BUDGET", 0))
+RUN_COST_BUDGET = float(os.getenv("RUN_COST_BUDGET", 0))
+# Цены в долларах за миллион токенов: {"модель": [вход, выход]}
+LLM_PRICES = json.loads(os.getenv("LLM_PRICES", "{}"))
+# Когда остается меньше этой доли бюджета, исследование сужается (меньше вопросов, без второго перехода по ссылкам)
+BUDGET_LOW_SHARE = float(os.getenv("BUDGET_LOW_SHARE", 0.3))
+# Остаток бюджета, который не тратится на поиск и остается на написание глав
+BUDGET_RESERVE_SHARE = float(os.getenv("BUDGET_RESERVE_SHARE", 0.1))
+
+
+class RunBudget:
+    """Учет токенов и стоимости вызовов LLM одного исследования."""
+
+    def __init__(self, max_tokens: int = RUN_TOKEN_BUDGET, max_cost: float = RUN_COST_BUDGET):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.tokens = 0
+        self.cost = 0.0
+
+    def charge(self, model: str, usage: Usage):
+        self.tokens += usage.total_tokens
+        input_price, output_price = LLM_PRICES.get(model, (0, 0))
+        self.cost += (usage.input_tokens * input_price + usage.output_tokens * output_price) / 1_000_000
+
+    def remaining_share(self) -> float:
+        shares = [1.0]
+        if self.max_tokens > 0:
+            shares.append(1 - self.tokens / self.max_tokens)
+        if self.max_cost > 0:
+            shares.append(1 - self.cost / self.max_cost)
+        return max(min(shares), 0.0)
+
+    def low(self) -> bool:
+        return self.remaining_share() < BUDGET_LOW_SHARE
+
+    def exhausted(self) -> bool:
+        return self.remaining_share() < BUDGET_RESERVE_SHARE
+
+    def stats(self) -> dict:
+        return {'tokens': self.tokens, 'cost': round(self.cost, 4), 'remaining_share': round(self.remaining_share(), 3)}
+
+
+# Бюджет текущего исследования. Задачи asyncio наследуют его от write_research
+run_budget: ContextVar[RunBudget | None] = ContextVar("run_budget", default=None)
+
+
+def current_budget() -> RunBudget | None:
+    return run_budget.get()
@@ -0,0 +1,108 @@
+import argparse
+import asyncio
+import json
+
+import aiohttp
+
+from api_client import ResearchApiClient, RESEARCH_API_URL
+from http_client import close_session
+from structured_outputs import ResearchRequest, TableOfConcepts
+
+DEFAULT_API_URL = "http://localhost:8001"
+
+
+async def submit(client: ResearchApiClient, args):
+    with open(args.table_of_concepts, encoding="utf-8") as f:
+        table_of_concepts = TableOfConcepts.model_validate_json(f.read())
+    job = await client.submit(ResearchRequest(
+        table_of_concepts=table_of_concepts,
+        breadth_of_research=args.breadth,
+        depth_of_research=args.depth,
+        relevancy_pass_rate=args.relevancy_pass_rate,
+        num_search_urls=args.num_search_urls,
+        num_search_arxiv=args.num_search_arxiv,
+        run_id=args.run_id
+    ))
+    print(f"job_id={job['job_id']} run_id={job['run_id']}")
+    if args.wait:
+        await wait(client, job['job_id'], args.output)
+
+
+async def wait(client: ResearchApiClient, job_id: str, output: str | None):
+    printed = 0
+    async for job in client.follow(job_id):
+        for chapter in job['chapters'][printed:]:
+            print(chapter.splitlines()[0] if chapter else "")
+        printed = len(job['chapters'])
+        print(f"[{job['status']}] {job['progress']:.0%} {job['progress_desc']}")
+    if job['status'] == "failed":
+        raise SystemExit(f"Job {job_id} failed: {job['error']}")
+    save_result(job, output)
+
+
+def save_result(job: dict, output: str | None):
+    if job['result'] is None:
+        raise SystemExit(f"Job {job['job_id']} is {job['status']}")
+    if output is None:
+        print(job['result'])
+    else:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(job['result'])
+        print(f"Saved to {output}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Клиент API исследований")
+    parser.add_argument("--api-url", default=RESEARCH_API_URL or DEFAULT_API_URL)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = commands.add_parser("submit", help="Поставить исследование в очередь по json с оглавлением")
+    submit_parser.add_argument("table_of_concepts")
+    submit_parser.add_argument("--breadth", type=int, default=2)
+    submit_parser.add_argument("--depth", type=int, default=2)
+    submit_parser.add_argument("--relevancy-pass-rate", type=int, default=7)
+    submit_parser.add_argument("--num-search-urls", type=int, default=5)
+    submit_parser.add_argument("--num-search-arxiv", type=int, default=3)
+    submit_parser.add_argument("--run-id", help="Продолжить исследование с этим run_id")
+    submit_parser.add_argument("--wait", action="store_true", help="Дождаться завершения")
+    submit_parser.add_argument("-o", "--output", help="Файл для итогового текста (с --wait)")
+
+    wait_parser = commands.add_parser("wait", help="Дождаться завершения задачи")
+    wait_parser.add_argument("job_id")
+    wait_parser.add_argument("-o", "--output")
+
+    status_parser = commands.add_parser("status", help="Статус задачи")
+    status_parser.add_argument("job_id")
+
+    result_parser = commands.add_parser("result", help="Итоговый текст завершенной задачи")
+    result_parser.add_argument("job_id")
+    result_parser.add_argument("-o", "--output")
+
+    list_parser = commands.add_parser("list", help="Последние задачи")
+    list_parser.add_argument("--status")
+
+    args = parser.parse_args()
+    client = ResearchApiClient(args.api_url)
+    try:
+        if args.command == "submit":
+            await submit(client, args)
+        elif args.command == "wait":
+            await wait(client, args.job_id, args.output)
+        elif args.command == "status":
+            job = await client.job(args.job_id)
+            job.pop('result')
+            job['chapters'] = len(job['chapters'])
+            print(json.dumps(job, ensure_ascii=False, indent=2))
+        elif args.command == "result":
+            save_result(await client.job(args.job_id), args.output)
+        elif args.command == "list":
+            for job in await client.jobs(args.status):
+                print(f"{job['job_id']}  {job['status']:8}  {job['progress']:.0%}  {job['params']['table_of_concepts']['title']}")
+    except aiohttp.ClientResponseError as e:
+        raise SystemExit(f"API error {e.status}: {e.message}")
+    finally:
+        await close_session()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
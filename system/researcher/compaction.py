@@ -0,0 +1,78 @@
+import os
+
+from llm import run_agent
+from relevance import estimate_tokens, CHARS_PER_TOKEN
+from research_agents import DigestCompactionAgent
+
+# Бюджеты в токенах на каждый накапливаемый блок промпта
+SUMMARIES_TOKEN_BUDGET = int(os.getenv("SUMMARIES_TOKEN_BUDGET", 8000))
+HYPOS_TOKEN_BUDGET = int(os.getenv("HYPOS_TOKEN_BUDGET", 2000))
+DONE_WORK_TOKEN_BUDGET = int(os.getenv("DONE_WORK_TOKEN_BUDGET", 6000))
+# Доля бюджета, до которой сжимается дайджест, чтобы следующее сжатие понадобилось не сразу
+DIGEST_TARGET_SHARE = float(os.getenv("DIGEST_TARGET_SHARE", 0.5))
+
+digest_compaction_agent = DigestCompactionAgent()
+
+
+class RollingDigest:
+    """Накопитель текстов для промпта с ограничением по токенам.
+    Свежие записи хранятся как есть, а когда все вместе перестает влезать в token_budget,
+    старые записи вместе с прошлым дайджестом сжимаются LLM в новый дайджест.
+    Так каждая запись сжимается один раз, а размер промпта не растет с числом записей."""
+
+    def __init__(self, name: str, token_budget: int):
+        self.name = name
+        self.token_budget = token_budget
+        self.digest = ""
+        self.recent: list[str] = []
+
+    def tokens(self) -> int:
+        return estimate_tokens(self.digest) + sum(estimate_tokens(item) for item in self.recent)
+
+    async def add(self, items: list[str]):
+        self.recent.extend(items)
+        if self.tokens() <= self.token_budget:
+            return
+
+        # Свежие записи оставляем целиком, пока они занимают не больше половины бюджета
+        keep = 0
+        kept_tokens = 0
+        for item in reversed(self.recent):
+            item_tokens = estimate_tokens(item)
+            if kept_tokens + item_tokens > self.token_budget // 2:
+                break
+            kept_tokens += item_tokens
+            keep += 1
+        old = self.recent[:len(self.recent) - keep]
+        self.recent = self.recent[len(self.recent) - keep:]
+
+        # Нижняя граница, чтобы дайджест не схлопнулся до пары слов, если бюджет почти занят свежими записями
+        target_tokens = max(int((self.token_budget - kept_tokens) * DIGEST_TARGET_SHARE), self.token_budget // 4)
+        self.digest = await compact(self.name, [self.digest] + old if self.digest else old, target_tokens)
+        print(f"Digest '{self.name}' compacted {len(old)} items to {estimate_tokens(self.digest)} tokens")
+
+    def state(self) -> dict:
+        return {'digest': self.digest, 'recent': list(self.recent)}
+
+    def restore(self, state: dict | None):
+        if state is not None:
+            self.digest = state['digest']
+            self.recent = list(state['recent'])
+
+    def render(self, empty: str) -> str:
+        parts = ([self.digest] if self.digest else []) + self.recent
+        return "\n".join(parts) if len(parts) > 0 else empty
+
+
+async def compact(name: str, texts: list[str], target_tokens: int) -> str:
+    """Сжимает тексты в один конспект примерно на target_tokens токенов.
+    Если LLM не справилась или превысила лимит, текст обрезается."""
+    target_chars = max(target_tokens, 1) * CHARS_PER_TOKEN
+    text = "\n\n".join(texts)
+    try:
+        digest = await run_agent(digest_compaction_agent, f"Ограничение: не длиннее {target_chars} символов.\n\n{text}")
+    except Exception as e:
+        print(f"Digest '{name}' compaction failed: {str(e)}")
+        digest = text
+    # Небольшое превышение допускаем, двойной запас все еще укладывается в бюджет при DIGEST_TARGET_SHARE=0.5
+    return digest[:target_chars * 2]
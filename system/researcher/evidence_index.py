@@ -0,0 +1,322 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+import numpy as np
+
+from relevance import tokenize, estimate_tokens, split_chunks, bm25_scores
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+EVIDENCE_INDEX_ENABLED = os.getenv("EVIDENCE_INDEX_ENABLED", "true").lower() == "true"
+EVIDENCE_INDEX_PATH = os.getenv("EVIDENCE_INDEX_PATH", os.path.join(CACHE_DIR, "evidence.sqlite"))
+# auto - sentence-transformers, если установлен, иначе hashing
+EVIDENCE_EMBEDDER = os.getenv("EVIDENCE_EMBEDDER", "auto")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+HASHING_DIM = int(os.getenv("HASHING_DIM", 512))
+EVIDENCE_TOP_K = int(os.getenv("EVIDENCE_TOP_K", 20))
+EVIDENCE_TOKEN_BUDGET = int(os.getenv("EVIDENCE_TOKEN_BUDGET", 6000))
+EVIDENCE_MIN_SCORE = float(os.getenv("EVIDENCE_MIN_SCORE", 0.2))
+EVIDENCE_TTL = int(os.getenv("EVIDENCE_TTL", 30 * 24 * 60 * 60))
+# Матрица векторов держится в памяти каждого процесса: 20000 записей по 512 float32 - около 40 МБ
+EVIDENCE_MAX_ENTRIES = int(os.getenv("EVIDENCE_MAX_ENTRIES", 20000))
+# Как часто (в секундах) из sqlite удаляются устаревшие записи и записи сверх EVIDENCE_MAX_ENTRIES
+EVIDENCE_PRUNE_INTERVAL = int(os.getenv("EVIDENCE_PRUNE_INTERVAL", 60 * 60))
+# Ответ на вопрос собирается из индекса без похода в интернет, если нашлось достаточно близких записей
+EVIDENCE_REUSE_ENABLED = os.getenv("EVIDENCE_REUSE_ENABLED", "false").lower() == "true"
+EVIDENCE_REUSE_MIN_SCORE = float(os.getenv("EVIDENCE_REUSE_MIN_SCORE", 0.6))
+EVIDENCE_REUSE_MIN_HITS = int(os.getenv("EVIDENCE_REUSE_MIN_HITS", 3))
+# Сколько самых релевантных вопросу кусков страницы попадает в индекс вместе с ее саммари
+EVIDENCE_CHUNKS_PER_PAGE = int(os.getenv("EVIDENCE_CHUNKS_PER_PAGE", 4))
+
+
+@dataclass
+class Evidence:
+    text: str
+    url: str | None
+    kind: str
+    run_id: str | None = None
+    chapter: str | None = None
+    score: float = 0.0
+
+
+# Запуск и глава, для которых сейчас собираются материалы. Ставится в research_chapter,
+# записи без явного run_id попадают в индекс с этой привязкой
+evidence_scope: ContextVar[tuple[str, str] | None] = ContextVar("evidence_scope", default=None)
+
+
+class HashingEmbedder:
+    """Эмбеддинг без модели: стеммы слов и пары соседних стеммов хэшируются в вектор фиксированной длины со знаком."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> list[str]:
+        words = tokenize(text)
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.md5(feature.encode()).digest()
+                index = int.from_bytes(digest[:4], "little") % self.dim
+                vectors[i, index] += 1.0 if digest[4] & 1 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name: str):
+        self.name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        # Модель грузится при первом использовании, чтобы не замедлять старт процесса
+        with self._lock:
+            if self._model is None:
+                self._model = SentenceTransformer(self.name, device="cpu")
+            return self._model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def create_embedder():
+    if EVIDENCE_EMBEDDER == "hashing" or (EVIDENCE_EMBEDDER == "auto" and SentenceTransformer is None):
+        return HashingEmbedder(HASHING_DIM)
+    if SentenceTransformer is None:
+        raise ImportError("EVIDENCE_EMBEDDER=sentence-transformers требует пакет sentence-transformers")
+    return SentenceTransformerEmbedder(EMBEDDING_MODEL)
+
+
+class EvidenceIndex:
+    """Локальный векторный индекс найденных материалов (саммари страниц и их кусков) с url источника.
+    Записи хранятся в sqlite вместе с векторами, поэтому индекс общий для процессов и запусков,
+    а поиск идет перебором по матрице векторов в памяти, которая догружается новыми записями перед каждым поиском.
+    Записи старше ttl и сверх max_entries (самые старые) удаляются и из sqlite, и из памяти.
+    Каждая запись помнит запуск и главу, для которых найдена, поэтому поиск можно ограничить текущим запуском.
+    Векторы разных эмбеддеров не смешиваются."""
+
+    def __init__(self, path: str, embedder, ttl: int, max_entries: int):
+        self.embedder = embedder
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(evidence)")]
+        if len(columns) > 0 and 'run_id' not in columns:
+            # Индекс без привязки к запускам нельзя безопасно смешивать с новым, он пересобирается с нуля
+            print("Evidence index has an old schema without run_id, rebuilding it")
+            self._db.execute("DROP TABLE evidence")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS evidence (
+                id INTEGER PRIMARY KEY,
+                embedder TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                text TEXT NOT NULL,
+                url TEXT,
+                kind TEXT NOT NULL,
+                run_id TEXT NOT NULL DEFAULT '',
+                chapter TEXT,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                UNIQUE (embedder, text_hash, run_id)
+            );
+            CREATE INDEX IF NOT EXISTS evidence_embedder ON evidence(embedder);
+            CREATE INDEX IF NOT EXISTS evidence_created_at ON evidence(created_at);
+        """)
+        self._db.commit()
+        self._last_id = 0
+        self._pruned_at = 0.0
+        self._added_since_prune = 0
+        # Матрица растет с запасом (удвоением), поэтому новые записи не копируют ее каждый раз целиком
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._created = np.zeros(0, dtype=np.float64)
+        self._runs = np.zeros(0, dtype=np.int32)
+        self._run_codes: dict[str, int] = {}
+        self._items: list[Evidence] = []
+
+    def add(self, items: list[Evidence]):
+        items = [item for item in items if item.text.strip()]
+        if len(items) == 0:
+            return
+        vectors = self.embedder.encode([item.text for item in items])
+        scope_run_id, scope_chapter = evidence_scope.get() or ('', None)
+        now = time.time()
+        with self._lock:
+            cursor = self._db.executemany(
+                "INSERT OR IGNORE INTO evidence(embedder, text_hash, text, url, kind, run_id, chapter, vector, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(self.embedder.name, hashlib.sha256(item.text.encode()).hexdigest(), item.text, item.url, item.kind,
+                  item.run_id or scope_run_id, item.chapter or scope_chapter, vector.tobytes(), now)
+                 for item, vector in zip(items, vectors)]
+            )
+            self._added_since_prune += max(cursor.rowcount, 0)
+            # Чистка не на каждую вставку, а раз в EVIDENCE_PRUNE_INTERVAL или после притока в десятую часть лимита
+            if now - self._pruned_at >= EVIDENCE_PRUNE_INTERVAL or self._added_since_prune >= max(self.max_entries // 10, 1):
+                self._prune_db(now)
+            self._db.commit()
+
+    def _prune_db(self, now: float):
+        self._db.execute("DELETE FROM evidence WHERE created_at < ?", (now - self.ttl,))
+        count = self._db.execute("SELECT COUNT(*) FROM evidence WHERE embedder = ?", (self.embedder.name,)).fetchone()[0]
+        if count > self.max_entries:
+            # Удаляем с запасом в 10% лимита, чтобы следующая вставка снова не упиралась в лимит
+            self._db.execute(
+                "DELETE FROM evidence WHERE embedder = ? AND id <= "
+                "(SELECT id FROM evidence WHERE embedder = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (self.embedder.name, self.embedder.name, self.max_entries * 9 // 10)
+            )
+        self._pruned_at = now
+        self._added_since_prune = 0
+
+    def _run_code(self, run_id: str) -> int:
+        return self._run_codes.setdefault(run_id, len(self._run_codes))
+
+    def _append(self, vectors: np.ndarray, created: np.ndarray, runs: np.ndarray):
+        count = len(self._items)
+        if count + len(vectors) > len(self._vectors):
+            capacity = max(count + len(vectors), 2 * len(self._vectors), 1024)
+            grown = np.zeros((capacity, vectors.shape[1]), dtype=np.float32)
+            grown_created = np.zeros(capacity, dtype=np.float64)
+            grown_runs = np.zeros(capacity, dtype=np.int32)
+            if count > 0:
+                grown[:count] = self._vectors[:count]
+                grown_created[:count] = self._created[:count]
+                grown_runs[:count] = self._runs[:count]
+            self._vectors = grown
+            self._created = grown_created
+            self._runs = grown_runs
+        self._vectors[count:count + len(vectors)] = vectors
+        self._created[count:count + len(vectors)] = created
+        self._runs[count:count + len(vectors)] = runs
+
+    def _prune(self):
+        """Убирает из памяти то же, что add удаляет из sqlite: записи старше ttl и самые старые сверх max_entries."""
+        count = len(self._items)
+        keep = self._created[:count] >= time.time() - self.ttl
+        keep[:max(count - self.max_entries, 0)] = False
+        if keep.all():
+            return
+        indexes = np.flatnonzero(keep)
+        self._vectors = self._vectors[indexes]
+        self._created = self._created[indexes]
+        self._runs = self._runs[indexes]
+        self._items = [self._items[i] for i in indexes]
+
+    def _refresh(self):
+        rows = self._db.execute(
+            "SELECT id, text, url, kind, run_id, chapter, vector, created_at FROM evidence WHERE embedder = ? AND id > ? ORDER BY id",
+            (self.embedder.name, self._last_id)
+        ).fetchall()
+        if len(rows) > 0:
+            self._append(np.stack([np.frombuffer(row[6], dtype=np.float32) for row in rows]),
+                         np.array([row[7] for row in rows], dtype=np.float64),
+                         np.array([self._run_code(row[4]) for row in rows], dtype=np.int32))
+            self._items.extend(Evidence(row[1], row[2], row[3], row[4] or None, row[5]) for row in rows)
+            self._last_id = rows[-1][0]
+        self._prune()
+
+    def search(self, query: str, top_k: int = EVIDENCE_TOP_K, token_budget: int = EVIDENCE_TOKEN_BUDGET,
+               min_score: float = EVIDENCE_MIN_SCORE, run_id: str | None = None, other_runs: bool = False) -> list[Evidence]:
+        """Самые похожие на запрос записи с оценкой не ниже min_score, не больше top_k и в пределах token_budget.
+        С run_id ищет только среди записей этого запуска, а с other_runs=True - только среди записей других запусков."""
+        if top_k <= 0:
+            return []
+        query_vector = self.embedder.encode([query])[0]
+        with self._lock:
+            self._refresh()
+            count = len(self._items)
+            if count == 0:
+                return []
+            scores = self._vectors[:count] @ query_vector
+            if run_id is not None:
+                same_run = self._runs[:count] == self._run_codes.get(run_id, -1)
+                scores[same_run if other_runs else ~same_run] = -np.inf
+            top = np.argpartition(-scores, top_k - 1)[:top_k] if count > top_k else np.arange(count)
+            results = []
+            used = 0
+            for i in top[np.argsort(-scores[top])]:
+                if scores[i] < min_score:
+                    break
+                tokens = estimate_tokens(self._items[i].text)
+                if used + tokens > token_budget:
+                    continue
+                used += tokens
+                item = self._items[i]
+                results.append(Evidence(item.text, item.url, item.kind, item.run_id, item.chapter, float(scores[i])))
+        return results
+
+    async def aadd(self, items: list[Evidence]):
+        await asyncio.to_thread(self.add, items)
+
+    async def asearch(self, query: str, **kwargs) -> list[Evidence]:
+        return await asyncio.to_thread(self.search, query, **kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            return {'embedder': self.embedder.name, 'entries': len(self._items)}
+
+
+def page_evidence(query: str, url: str, summary: str, content: str | None) -> list[Evidence]:
+    """Саммари страницы и ее самые релевантные вопросу куски."""
+    items = [Evidence(summary, url, "summary")]
+    if content:
+        chunks = split_chunks(content)
+        scores = bm25_scores(query, chunks)
+        for i in sorted(range(len(chunks)), key=lambda i: -scores[i])[:EVIDENCE_CHUNKS_PER_PAGE]:
+            if scores[i] > 0:
+                items.append(Evidence(chunks[i], url, "chunk"))
+    return items
+
+
+async def remember(items: list[Evidence]):
+    """Добавляет записи в индекс. Ошибка индекса не должна ломать исследование, поэтому только логируется."""
+    if not EVIDENCE_INDEX_ENABLED:
+        return
+    try:
+        await evidence_index.aadd(items)
+    except Exception as e:
+        print(f"Evidence index add failed: {type(e).__name__}: {str(e)}")
+
+
+async def remember_page(query: str, url: str, summary: str, content: str | None):
+    """Добавляет в индекс саммари страницы и ее куски. Разбиение и BM25 по тексту страницы тоже идут
+    в потоке и под той же защитой, что и запись в индекс."""
+    if not EVIDENCE_INDEX_ENABLED:
+        return
+    try:
+        await asyncio.to_thread(lambda: evidence_index.add(page_evidence(query, url, summary, content)))
+    except Exception as e:
+        print(f"Evidence index add failed for {url}: {type(e).__name__}: {str(e)}")
+
+
+async def recall(query: str, **kwargs) -> list[Evidence]:
+    if not EVIDENCE_INDEX_ENABLED:
+        return []
+    try:
+        return await evidence_index.asearch(query, **kwargs)
+    except Exception as e:
+        print(f"Evidence index search failed: {type(e).__name__}: {str(e)}")
+        return []
+
+
+def render_evidence(items: list[Evidence], empty: str) -> str:
+    if len(items) == 0:
+        return empty
+    return "\n\n".join(f"[{item.url or 'заметка исследования'}]\n{item.text}" for item in items)
+
+
+evidence_index = EvidenceIndex(EVIDENCE_INDEX_PATH, create_embedder(), EVIDENCE_TTL, EVIDENCE_MAX_ENTRIES)
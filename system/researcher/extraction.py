@@ -0,0 +1,86 @@
+import re
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup, Tag
+from markdownify import markdownify
+
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "iframe", "svg", "canvas", "form", "button", "input",
+                    "select", "nav", "footer", "aside"]
+BOILERPLATE_RE = re.compile(r"cookie|consent|gdpr|banner|navbar|menu|sidebar|footer|breadcrumb|share|social|"
+                            r"subscribe|newsletter|advert|promo|popup|modal|related|comment|signup|login", re.IGNORECASE)
+CONTENT_RE = re.compile(r"article|content|main|post|entry|story|text|body", re.IGNORECASE)
+CANDIDATE_TAGS = ["article", "main", "section", "div", "td"]
+MIN_PARAGRAPH_LEN = 25
+# Если найденный блок содержит меньше этой доли текста страницы, берем всю страницу
+MIN_CONTENT_SHARE = 0.2
+
+
+def _attributes(tag: Tag) -> str:
+    return " ".join(tag.get("class") or []) + " " + (tag.get("id") or "")
+
+
+def _link_density(tag: Tag) -> float:
+    text_len = len(tag.get_text(" ", strip=True))
+    if text_len == 0:
+        return 1.0
+    link_len = sum(len(a.get_text(" ", strip=True)) for a in tag.find_all("a"))
+    return link_len / text_len
+
+
+def _remove_boilerplate(soup: BeautifulSoup):
+    for tag in soup(BOILERPLATE_TAGS):
+        tag.decompose()
+    for tag in soup.find_all(CANDIDATE_TAGS + ["header", "ul", "span", "p"]):
+        if tag.decomposed:
+            continue
+        attributes = _attributes(tag)
+        if BOILERPLATE_RE.search(attributes) and not CONTENT_RE.search(attributes):
+            tag.decompose()
+
+
+def _best_candidate(soup: BeautifulSoup) -> Tag | None:
+    """Оценка блоков в духе readability: абзацы начисляют очки родителю и прародителю,
+    итог штрафуется за плотность ссылок."""
+    scores: dict[int, float] = {}
+    nodes: dict[int, Tag] = {}
+    for paragraph in soup.find_all(["p", "pre", "blockquote", "li"]):
+        text = paragraph.get_text(" ", strip=True)
+        if len(text) < MIN_PARAGRAPH_LEN:
+            continue
+        score = 1 + text.count(",") + min(len(text) / 100, 3)
+        for weight, node in ((1.0, paragraph.parent), (0.5, paragraph.parent.parent if paragraph.parent else None)):
+            if node is None or node.name not in CANDIDATE_TAGS:
+                continue
+            if id(node) not in nodes:
+                nodes[id(node)] = node
+                scores[id(node)] = 5.0 if CONTENT_RE.search(_attributes(node)) or node.name in ("article", "main") else 0.0
+            scores[id(node)] += score * weight
+
+    if len(scores) == 0:
+        return None
+    best = max(scores, key=lambda key: scores[key] * (1 - _link_density(nodes[key])))
+    return nodes[best]
+
+
+def extract_main_content(html: str, base_url: str) -> str:
+    """Вырезает меню, футеры, баннеры, скрипты и сайдбары и возвращает html основного текста страницы.
+    Ссылки делаются абсолютными, чтобы LLM могла предложить их в interesting_web_page_urls."""
+    soup = BeautifulSoup(html, "html.parser")
+    _remove_boilerplate(soup)
+    for link in soup.find_all("a", href=True):
+        link["href"] = urljoin(base_url, link["href"])
+
+    root = soup.body or soup
+    candidate = _best_candidate(soup)
+    if candidate is None:
+        return str(root)
+    # Слишком маленький блок скорее всего не статья, а случайный абзац, тогда лучше отдать всю очищенную страницу
+    total_len = len(root.get_text(" ", strip=True))
+    if len(candidate.get_text(" ", strip=True)) < MIN_CONTENT_SHARE * total_len:
+        return str(root)
+    return str(candidate)
+
+
+def html_to_markdown(html: str, base_url: str) -> str:
+    markdown_content = markdownify(extract_main_content(html, base_url)).strip()
+    return re.sub(r"\n{3,}", "\n\n", markdown_content)
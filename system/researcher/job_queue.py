@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join(CACHE_DIR, "jobs.sqlite"))
+# Задача в статусе running без heartbeat дольше этого времени считается брошенной упавшим воркером
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", 10 * 60))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class RunInProgressError(Exception):
+    """В очереди или в работе уже есть задача с тем же run_id: два воркера перезаписывали бы чекпоинты друг друга."""
+
+
+@dataclass
+class Job:
+    job_id: str
+    run_id: str
+    status: str
+    params: dict
+    chapters: list[str]
+    progress: float
+    progress_desc: str
+    result: str | None
+    error: str | None
+    created_at: float
+    started_at: float | None
+    finished_at: float | None
+
+    def to_dict(self) -> dict:
+        return self.__dict__.copy()
+
+
+class JobQueue:
+    """Очередь исследований на sqlite, общая для API и процессов воркеров.
+    Воркер забирает задачу атомарно, пока пишет главы обновляет heartbeat, а задачи упавших воркеров
+    возвращаются в очередь и продолжаются с чекпоинта по run_id."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                params TEXT NOT NULL,
+                chapters TEXT NOT NULL DEFAULT '[]',
+                progress REAL NOT NULL DEFAULT 0,
+                progress_desc TEXT NOT NULL DEFAULT '',
+                result TEXT,
+                error TEXT,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status_created_at ON jobs(status, created_at);
+        """)
+
+    def enqueue(self, params: dict, run_id: str | None = None) -> Job:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                active = self._db.execute(
+                    "SELECT job_id FROM jobs WHERE run_id = ? AND status IN (?, ?) LIMIT 1", (run_id or job_id, QUEUED, RUNNING)
+                ).fetchone()
+                if active is not None:
+                    raise RunInProgressError(f"Исследование {run_id} уже выполняется в задаче {active[0]}")
+                self._db.execute(
+                    "INSERT INTO jobs(job_id, run_id, status, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (job_id, run_id or job_id, QUEUED, json.dumps(params, ensure_ascii=False), time.time())
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return self.get(job_id)
+
+    def claim(self, worker: str) -> Job | None:
+        """Забирает самую старую задачу из очереди. BEGIN IMMEDIATE не дает двум воркерам взять одну задачу."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat_at < ?",
+                    (QUEUED, RUNNING, now - JOB_STALE_AFTER)
+                )
+                row = self._db.execute(
+                    "SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, started_at = ?, heartbeat_at = ?, chapters = '[]' WHERE job_id = ?",
+                        (RUNNING, worker, now, now, row[0])
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row is not None else None
+
+    def heartbeat(self, job_id: str, progress: float | None = None, progress_desc: str | None = None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET heartbeat_at = ?, progress = COALESCE(?, progress), progress_desc = COALESCE(?, progress_desc) WHERE job_id = ?",
+                (time.time(), progress, progress_desc, job_id)
+            )
+
+    def add_chapter(self, job_id: str, chapter: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET chapters = json_insert(chapters, '$[#]', ?), heartbeat_at = ? WHERE job_id = ?",
+                (chapter, time.time(), job_id)
+            )
+
+    def finish(self, job_id: str, result: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, progress = 1, finished_at = ? WHERE job_id = ?",
+                (DONE, result, time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                (FAILED, error, time.time(), job_id)
+            )
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT job_id, run_id, status, params, chapters, progress, progress_desc, result, error, created_at, started_at, finished_at "
+                "FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return Job(row[0], row[1], row[2], json.loads(row[3]), json.loads(row[4]), *row[5:])
+
+    def list(self, status: str | None = None, limit: int = 100) -> list[Job]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT job_id FROM jobs WHERE ? IS NULL OR status = ? ORDER BY created_at DESC LIMIT ?",
+                (status, status, limit)
+            ).fetchall()
+        return [self.get(row[0]) for row in rows]
+
+
+job_queue = JobQueue(JOB_QUEUE_PATH)
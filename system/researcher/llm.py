@@ -0,0 +1,57 @@
+import json
+
+import openai
+from agents import Agent, Runner, RunContextWrapper
+
+from budget import current_budget
+from llm_cache import llm_cache, model_name
+from rate_limit import get_limiter
+from relevance import estimate_tokens
+from resilience import call_with_retry, retry_after
+
+# Резерв под ответ модели при оценке токенов запроса
+OUTPUT_TOKENS_ESTIMATE = 1000
+
+
+async def estimate_request_tokens(agent: Agent, input, context) -> int:
+    instructions = await agent.get_system_prompt(RunContextWrapper(context)) or ""
+    return estimate_tokens(instructions) + estimate_tokens(json.dumps(input, ensure_ascii=False, default=str)) + OUTPUT_TOKENS_ESTIMATE
+
+
+async def run_limited(agent: Agent, input, context=None):
+    """Один вызов Runner.run с учетом лимитов модели и бюджета исследования."""
+    model = model_name(agent)
+    limiter = get_limiter(model)
+    request = await limiter.acquire(await estimate_request_tokens(agent, input, context))
+    try:
+        result = await Runner.run(agent, input, context=context)
+    except openai.RateLimitError as e:
+        limiter.penalize(retry_after(e))
+        raise
+    usage = result.context_wrapper.usage
+    limiter.record(request, usage.total_tokens)
+    budget = current_budget()
+    if budget is not None:
+        budget.charge(model, usage)
+    return result
+
+
+async def run_agent(agent: Agent, input, context=None, use_cache: bool = True):
+    """Запуск агента через Runner.run с кэшированием ответа и повторами при временных ошибках. Возвращает final_output.
+    Все вызовы LLM должны идти через эту функцию, чтобы соблюдались лимиты запросов и токенов в минуту и бюджет исследования.
+    use_cache=False или имя агента в LLM_CACHE_BYPASS_AGENTS отключают кэш для конкретного вызова."""
+    key = None
+    if use_cache and not llm_cache.bypass(agent):
+        key = llm_cache.key(agent, input)
+
+    if key is None:
+        llm_cache.counters['bypassed'] += 1
+    else:
+        cached = await llm_cache.get(agent, key)
+        if cached is not None:
+            return cached
+
+    result = await call_with_retry("llm", lambda: run_limited(agent, input, context))
+    if key is not None:
+        await llm_cache.put(agent, key, result.final_output)
+    return result.final_output
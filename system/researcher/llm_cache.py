@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, Counter
+from typing import Protocol
+
+from agents import Agent
+from agents.models import openai_provider
+from pydantic import BaseModel
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm.sqlite"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 512 * 1024 ** 2))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 30 * 24 * 60 * 60))
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", 2048))
+# Имена агентов через запятую, ответы которых никогда не кэшируются
+LLM_CACHE_BYPASS_AGENTS = {name.strip() for name in os.getenv("LLM_CACHE_BYPASS_AGENTS", "").split(",") if name.strip()}
+
+
+def model_name(agent: Agent) -> str:
+    model = agent.model if agent.model is not None else openai_provider.DEFAULT_MODEL
+    return model if isinstance(model, str) else getattr(model, 'model', str(model))
+
+
+class LLMCacheBackend(Protocol):
+    def get(self, key: str) -> str | None: ...
+
+    def put(self, key: str, value: str): ...
+
+
+class MemoryLLMCache:
+    """LRU кэш в памяти процесса с ttl."""
+
+    def __init__(self, max_items: int, ttl: int):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    def get(self, key: str) -> str | None:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        created_at, value = item
+        if time.time() - created_at > self.ttl:
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str):
+        self._items[key] = (time.time(), value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+
+class SqliteLLMCache:
+    """Кэш ответов на диске с ttl и вытеснением давно не использованных записей по размеру."""
+
+    def __init__(self, path: str, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                cache_key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses(accessed_at);
+        """)
+        self._db.commit()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created_at FROM responses WHERE cache_key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE cache_key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE cache_key = ?", (now, key))
+            self._db.commit()
+            return row[0]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses(cache_key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode()), now, now)
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT cache_key, size FROM responses ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE cache_key = ?", (key,))
+            total -= size
+
+
+class LLMCache:
+    """Двухуровневый кэш ответов агентов: сначала память процесса, затем backend (по умолчанию sqlite).
+    Ключ строится из модели, имени агента, инструкций, входа и схемы ответа."""
+
+    def __init__(self, memory: MemoryLLMCache, backend: LLMCacheBackend | None):
+        self.memory = memory
+        self.backend = backend
+        self.counters = Counter(hits=0, misses=0, bypassed=0)
+
+    @staticmethod
+    def key(agent: Agent, input) -> str | None:
+        # Динамические инструкции зависят от контекста запуска, такие ответы не кэшируем
+        if not isinstance(agent.instructions, str):
+            return None
+        output_type = agent.output_type
+        if isinstance(output_type, type) and issubclass(output_type, BaseModel):
+            output_schema = output_type.model_json_schema()
+        else:
+            output_schema = str(output_type)
+        payload = json.dumps({
+            'model': model_name(agent),
+            'agent': agent.name,
+            'instructions': agent.instructions,
+            'input': input,
+            'output_schema': output_schema,
+        }, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def bypass(self, agent: Agent) -> bool:
+        return not LLM_CACHE_ENABLED or agent.name in LLM_CACHE_BYPASS_AGENTS
+
+    async def get(self, agent: Agent, key: str):
+        value = self.memory.get(key)
+        if value is None and self.backend is not None:
+            value = await asyncio.to_thread(self.backend.get, key)
+            if value is not None:
+                self.memory.put(key, value)
+        if value is None:
+            self.counters['misses'] += 1
+            return None
+        self.counters['hits'] += 1
+        return self._loads(agent, value)
+
+    async def put(self, agent: Agent, key: str, output):
+        value = self._dumps(output)
+        self.memory.put(key, value)
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.put, key, value)
+
+    @staticmethod
+    def _dumps(output) -> str:
+        if isinstance(output, BaseModel):
+            return json.dumps({'model': output.model_dump(mode='json')}, ensure_ascii=False)
+        return json.dumps({'value': output}, ensure_ascii=False)
+
+    @staticmethod
+    def _loads(agent: Agent, value: str):
+        value = json.loads(value)
+        if 'model' in value:
+            return agent.output_type.model_validate(value['model'])
+        return value['value']
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+llm_cache = LLMCache(
+    MemoryLLMCache(LLM_CACHE_MEMORY_ITEMS, LLM_CACHE_TTL),
+    SqliteLLMCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL)
+)
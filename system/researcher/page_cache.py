@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from urls import normalize_url
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", os.path.join(CACHE_DIR, "pages.sqlite"))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", 7 * 24 * 60 * 60))
+
+
+@dataclass
+class CachedPage:
+    url: str
+    content_hash: str
+    content_type: str
+    markdown: str
+
+
+class PageCache:
+    """Кэш скачанных страниц и распарсенных PDF на sqlite.
+    Содержимое хранится по sha256 хэшу (одинаковые страницы с разных url хранятся один раз),
+    url указывает на хэш. Записи старше ttl считаются промахом, при превышении max_bytes
+    вытесняются давно не использованные записи."""
+
+    def __init__(self, path: str, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.counters = Counter(hits=0, misses=0, expired=0, stores=0, evictions=0)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS contents (
+                content_hash TEXT PRIMARY KEY,
+                body BLOB,
+                markdown TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS contents_accessed_at ON contents(accessed_at);
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    def get(self, url: str) -> CachedPage | None:
+        url = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT u.content_hash, u.content_type, u.fetched_at, c.markdown FROM urls u "
+                "JOIN contents c ON c.content_hash = u.content_hash WHERE u.url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                self.counters['misses'] += 1
+                return None
+            content_hash, content_type, fetched_at, markdown = row
+            if now - fetched_at > self.ttl:
+                self.counters['expired'] += 1
+                return None
+            self._db.execute("UPDATE contents SET accessed_at = ? WHERE content_hash = ?", (now, content_hash))
+            self._db.commit()
+            self.counters['hits'] += 1
+            return CachedPage(url=url, content_hash=content_hash, content_type=content_type, markdown=markdown)
+
+    def put(self, url: str, content_type: str, markdown: str, body: bytes | None = None):
+        url = normalize_url(url)
+        content_hash = hashlib.sha256(body if body is not None else markdown.encode()).hexdigest()
+        size = len(markdown.encode()) + (len(body) if body is not None else 0)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO contents(content_hash, body, markdown, size, accessed_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(content_hash) DO UPDATE SET accessed_at = excluded.accessed_at",
+                (content_hash, body, markdown, size, now)
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO urls(url, content_hash, content_type, fetched_at) VALUES (?, ?, ?, ?)",
+                (url, content_hash, content_type, now)
+            )
+            self.counters['stores'] += 1
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM contents").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for content_hash, size in self._db.execute("SELECT content_hash, size FROM contents ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM contents WHERE content_hash = ?", (content_hash,))
+            total -= size
+            self.counters['evictions'] += 1
+        self._db.execute("DELETE FROM urls WHERE content_hash NOT IN (SELECT content_hash FROM contents)")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM contents").fetchone()
+        requests = self.counters['hits'] + self.counters['misses'] + self.counters['expired']
+        return {
+            **self.counters,
+            'hit_rate': self.counters['hits'] / requests if requests > 0 else 0.0,
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+        }
+
+    async def aget(self, url: str) -> CachedPage | None:
+        return await asyncio.to_thread(self.get, url)
+
+    async def aput(self, url: str, content_type: str, markdown: str, body: bytes | None = None):
+        await asyncio.to_thread(self.put, url, content_type, markdown, body)
+
+
+page_cache = PageCache(PAGE_CACHE_PATH, PAGE_CACHE_MAX_BYTES, PAGE_CACHE_TTL)
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+# Лимиты по умолчанию на модель и переопределения в виде {"модель": {"rpm": 500, "tpm": 200000}}
+LLM_RPM = int(os.getenv("LLM_RPM", 60))
+LLM_TPM = int(os.getenv("LLM_TPM", 200000))
+LLM_RATE_LIMITS = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+# Пауза для всех вызовов модели после 429 без заголовка Retry-After
+RATE_LIMIT_COOLDOWN = float(os.getenv("RATE_LIMIT_COOLDOWN", 10))
+WINDOW = 60
+
+
+class ModelRateLimiter:
+    """Ограничение запросов и токенов в минуту для одной модели на весь процесс (скользящее окно в 60 секунд).
+    Токены запроса резервируются по оценке, а после ответа заменяются фактическими.
+    После 429 все вызовы модели ставятся на паузу до истечения Retry-After."""
+
+    def __init__(self, model: str, rpm: int, tpm: int):
+        self.model = model
+        self.rpm = rpm
+        self.tpm = tpm
+        self.blocked_until = 0.0
+        # (время, число токенов) по каждому запросу в окне, изменяемый список чтобы поправить оценку
+        self._requests: deque[list] = deque()
+        self._lock = asyncio.Lock()
+
+    def _used_tokens(self) -> int:
+        return sum(tokens for _, tokens in self._requests)
+
+    def _wait_time(self, now: float, tokens: int) -> float:
+        while len(self._requests) > 0 and now - self._requests[0][0] >= WINDOW:
+            self._requests.popleft()
+        wait = self.blocked_until - now
+        if len(self._requests) >= self.rpm:
+            wait = max(wait, self._requests[0][0] + WINDOW - now)
+        # Запрос больше всего tpm пропускаем, когда окно пустое, иначе он не пройдет никогда
+        if len(self._requests) > 0 and self._used_tokens() + tokens > self.tpm:
+            wait = max(wait, self._requests[0][0] + WINDOW - now)
+        return wait
+
+    async def acquire(self, tokens: int) -> list:
+        """Ждет свободного места в окне и резервирует его. Возвращает запись для record."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    request = [now, tokens]
+                    self._requests.append(request)
+                    return request
+                await asyncio.sleep(wait)
+
+    @staticmethod
+    def record(request: list, tokens: int):
+        request[1] = tokens
+
+    def penalize(self, delay: float | None):
+        delay = RATE_LIMIT_COOLDOWN if delay is None else delay
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        print(f"Rate limited by {self.model}, pausing calls for {delay:.1f}s")
+
+
+limiters: dict[str, ModelRateLimiter] = {}
+
+
+def get_limiter(model: str) -> ModelRateLimiter:
+    if model not in limiters:
+        limits = LLM_RATE_LIMITS.get(model, {})
+        limiters[model] = ModelRateLimiter(model, limits.get("rpm", LLM_RPM), limits.get("tpm", LLM_TPM))
+    return limiters[model]
@@ -0,0 +1,140 @@
+import math
+import os
+import re
+from collections import Counter
+
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "true").lower() == "true"
+# Доля слов запроса, которые должны встретиться в тексте, чтобы он ушел на оценку в LLM
+PREFILTER_MIN_SCORE = float(os.getenv("PREFILTER_MIN_SCORE", 0.2))
+# Бюджет на контент страницы в промпте summarize_content
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", 12000))
+CHUNK_CHARS = int(os.getenv("CHUNK_CHARS", 1500))
+CHARS_PER_TOKEN = 4
+# Слова сравниваются по первым STEM_LENGTH символам, этого хватает как грубого стемминга для русского и английского
+STEM_LENGTH = 6
+
+STOP_WORDS = {
+    "как", "что", "это", "для", "или", "при", "его", "она", "они", "так", "все", "был", "быть", "где", "когда",
+    "какие", "каков", "какова", "каковы", "какой", "какая", "каким", "между", "чем", "над", "под", "без", "про",
+    "the", "and", "for", "with", "what", "how", "are", "was", "which", "that", "this", "from", "into", "does",
+    "why", "who", "when", "where", "can", "its", "their", "there",
+}
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+CYRILLIC_RE = re.compile(r"[а-яё]", re.IGNORECASE)
+LATIN_RE = re.compile(r"[a-z]", re.IGNORECASE)
+
+
+def tokenize(text: str) -> list[str]:
+    words = WORD_RE.findall(text.lower())
+    return [word[:STEM_LENGTH] for word in words if len(word) > 2 and word not in STOP_WORDS]
+
+
+def script(text: str) -> str:
+    return "cyrillic" if len(CYRILLIC_RE.findall(text)) > len(LATIN_RE.findall(text)) else "latin"
+
+
+def query_coverage(query: str, text: str) -> float:
+    """Доля уникальных слов запроса, встретившихся в тексте."""
+    terms = set(tokenize(query))
+    if len(terms) == 0:
+        return 1.0
+    vocabulary = set(tokenize(text))
+    return len(terms & vocabulary) / len(terms)
+
+
+def prefilter(query: str, text: str, source: str, min_score: float = PREFILTER_MIN_SCORE) -> bool:
+    """Дешевая проверка перед вызовом LLM. Отсекает тексты, в которых почти нет слов запроса.
+    Текст на другом языке, чем запрос, не отсекается, так как лексически их не сравнить."""
+    if not PREFILTER_ENABLED:
+        return True
+    if script(query) != script(text[:10000]):
+        return True
+    score = query_coverage(query, text)
+    if score < min_score:
+        print(f"Prefilter skipped {source}: score={score:.2f} < {min_score}")
+        return False
+    return True
+
+
+def rank_by_coverage(query: str, texts: list[str], sources: list[str], min_score: float = PREFILTER_MIN_SCORE) -> list[int]:
+    """Индексы текстов, прошедших prefilter, по убыванию покрытия запроса."""
+    passed = [i for i, text in enumerate(texts) if prefilter(query, text, sources[i], min_score)]
+    return sorted(passed, key=lambda i: -query_coverage(query, texts[i]))
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_chunks(text: str, chunk_chars: int = CHUNK_CHARS) -> list[str]:
+    """Делит markdown на куски по абзацам, склеивая короткие абзацы до chunk_chars."""
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if len(paragraph) == 0:
+            continue
+        while len(paragraph) > chunk_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:chunk_chars])
+            paragraph = paragraph[chunk_chars:]
+        if current and len(current) + len(paragraph) + 2 > chunk_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def bm25_scores(query: str, chunks: list[str], k1: float = 1.5, b: float = 0.75) -> list[float]:
+    terms = set(tokenize(query))
+    chunk_terms = [Counter(tokenize(chunk)) for chunk in chunks]
+    avg_len = sum(sum(counts.values()) for counts in chunk_terms) / max(len(chunks), 1) or 1
+    document_frequency = Counter(term for counts in chunk_terms for term in counts if term in terms)
+    scores = []
+    for counts in chunk_terms:
+        length = sum(counts.values())
+        score = 0.0
+        for term in terms:
+            tf = counts.get(term, 0)
+            if tf == 0:
+                continue
+            idf = math.log(1 + (len(chunks) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_len))
+        scores.append(score)
+    return scores
+
+
+def select_relevant_chunks(query: str, text: str, token_budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """Оставляет из текста самые релевантные запросу куски в пределах token_budget, сохраняя их исходный порядок.
+    Первый кусок (обычно заголовок и начало) сохраняется всегда. При равных оценках
+    предпочтение отдается кускам ближе к началу, так что без совпадений получается обычное обрезание."""
+    if estimate_tokens(text) <= token_budget:
+        return text
+
+    chunks = split_chunks(text)
+    scores = bm25_scores(query, chunks)
+    order = [0] + sorted(range(1, len(chunks)), key=lambda i: -scores[i])
+    selected = []
+    used = 0
+    for i in order:
+        tokens = estimate_tokens(chunks[i])
+        if used + tokens > token_budget:
+            continue
+        selected.append(i)
+        used += tokens
+
+    if len(selected) == 0:
+        return text[:token_budget * CHARS_PER_TOKEN]
+
+    parts = []
+    previous = -1
+    for i in sorted(selected):
+        if previous >= 0 and i != previous + 1:
+            parts.append("[...]")
+        parts.append(chunks[i])
+        previous = i
+    return "\n\n".join(parts)
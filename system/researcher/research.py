@@ -0,0 +1,398 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable
+
+from openai.types.responses import EasyInputMessageParam
+
+from research_agents import FollowUpQuestionsAgent, HyposGeneratingAgent, ChapterEditorAgent, \
+    ChapterEditorSummaryAgent, TableOfConceptsAgent, TableOfConceptsSearchAgent
+from compaction import RollingDigest, SUMMARIES_TOKEN_BUDGET, HYPOS_TOKEN_BUDGET, DONE_WORK_TOKEN_BUDGET
+from arxiv_search import arxiv_cache
+from budget import RunBudget, run_budget, current_budget
+from evidence_index import Evidence, evidence_index, evidence_scope, recall, remember, render_evidence, EVIDENCE_INDEX_ENABLED, \
+    EVIDENCE_REUSE_ENABLED, EVIDENCE_REUSE_MIN_SCORE, EVIDENCE_REUSE_MIN_HITS, EVIDENCE_TOP_K, EVIDENCE_TOKEN_BUDGET
+from relevance import estimate_tokens
+from llm import run_agent
+from llm_cache import llm_cache
+from page_cache import page_cache
+from run_store import run_store, fingerprint
+from urls import UrlRegistry, dedupe_urls
+from web_search import search_many, search_cache
+from structured_outputs import TableOfConcepts, Chapter, FollowUpQuestions, NewHypothesis, ChapterText
+from tools import search_web, search_arxiv_relevant_pdfs_and_summarize
+
+CHAPTER_RESEARCH_CONCURRENCY = int(os.getenv("CHAPTER_RESEARCH_CONCURRENCY", 3))
+RUN_QUESTION_CONCURRENCY = int(os.getenv("RUN_QUESTION_CONCURRENCY", 4))
+TABLE_OF_CONCEPTS_MODEL = os.getenv("TABLE_OF_CONCEPTS_MODEL", "openai/gpt-4.1-mini")
+
+# Общий на процесс бюджет одновременно исследуемых глав
+chapter_research_semaphore = asyncio.Semaphore(CHAPTER_RESEARCH_CONCURRENCY)
+
+table_of_concepts_agent = TableOfConceptsAgent(model=TABLE_OF_CONCEPTS_MODEL)
+table_of_concepts_search = TableOfConceptsSearchAgent(model=TABLE_OF_CONCEPTS_MODEL)
+follow_up_questions_agent = FollowUpQuestionsAgent()
+hypos_agent = HyposGeneratingAgent()
+chapter_editor_agent = ChapterEditorAgent()
+chapter_editor_summary_agent = ChapterEditorSummaryAgent()
+
+
+def print_used_urls(urls):
+    output = "## Написано на основании\n"
+    if len(urls) == 0:
+        return ""
+
+    for i, url in enumerate(dedupe_urls(urls)):
+        output = output + f'{i+1}. {url}\n'
+
+    return output
+
+
+def print_failed_questions(failed_questions: dict[str, list[str]]):
+    if len(failed_questions) == 0:
+        return ""
+
+    output = "\n# Вопросы, на которые не удалось найти ответ\n"
+    for chapter_name, questions in failed_questions.items():
+        output = output + f"## {chapter_name}\n" + "".join(f"- {question}\n" for question in questions)
+    return output
+
+
+def print_chapter(chapter_name, visited_urls, chapter_text, final=True):
+    return f"# {chapter_name}\n{print_used_urls(visited_urls) if final else ''}\n{chapter_text}"
+
+
+def get_research(table_of_concepts, dic_visited_urls, done_chapters, final=False):
+    chapters = [print_chapter(chapter.chapter_name, dic_visited_urls[chapter.chapter_name], done_chapters[chapter.chapter_name], final)
+                for chapter in table_of_concepts.chapters if chapter.chapter_name in done_chapters]
+    return "\n".join([f"# {table_of_concepts.title}"] + chapters)
+
+
+async def write_table_of_concepts(history: list[EasyInputMessageParam]) -> TableOfConcepts:
+    """Оглавление по диалогу с пользователем: сначала агент с поиском в интернете, затем перевод его ответа в json."""
+    # Без кэша, чтобы повторный запрос давал новый вариант оглавления
+    result = await run_agent(table_of_concepts_search, history, use_cache=False)
+    result = await run_agent(table_of_concepts_agent,  history + [EasyInputMessageParam(role="assistant", content=result), EasyInputMessageParam(role="user", content="перепиши в json")], use_cache=False)
+    return TableOfConcepts.model_validate(result)
+
+
+async def answer_question(question: str, relevancy_pass_rate, num_search_urls, num_search_arxiv, registry: UrlRegistry,
+                          search_results: list[dict] | None = None):
+    """Поиск в интернете и в arxiv по одному вопросу. Возвращает саммари и посещенные url в порядке web, arxiv,
+    или None, если не удались оба поиска. Повторы с задержками делаются внутри вызовов сервисов (resilience.py).
+    search_results - готовая выдача SearXNG по вопросу, если поиск уже сделан для всех вопросов раунда.
+    При EVIDENCE_REUSE_ENABLED вопрос, на который хватает материалов в локальном индексе, в интернете не ищется."""
+    if EVIDENCE_REUSE_ENABLED:
+        hits = await recall(question, min_score=EVIDENCE_REUSE_MIN_SCORE)
+        if len(hits) >= EVIDENCE_REUSE_MIN_HITS:
+            print(f"Answering question '{question}' from evidence index: {len(hits)} hits")
+            return [render_evidence(hits, "")], dedupe_urls([hit.url for hit in hits if hit.url])
+
+    web_urls = []
+    arxiv_urls = []
+    results = await asyncio.gather(
+        search_web(question, relevancy_pass_rate, num_search_urls, web_urls, registry, search_results),
+        search_arxiv_relevant_pdfs_and_summarize(question, relevancy_pass_rate, num_search_arxiv, arxiv_urls, registry),
+        return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for error in errors:
+        if isinstance(error, asyncio.CancelledError):
+            raise error
+        print(f"Answering question '{question}': {type(error).__name__}: {str(error)}")
+    if len(errors) == len(results):
+        return None
+    summaries = [result for result in results if result is not None and not isinstance(result, BaseException)]
+    await remember([Evidence(f"{question}\n{summary}", None, "answer") for summary in summaries])
+    return summaries, web_urls + arxiv_urls
+
+
+async def retrieve_evidence(context: dict, queries: list[str]):
+    """Кладет в context['evidence'] самые релевантные главе фрагменты из индекса, которые промпты показывают
+    вместе с дайджестом саммари главы, и возвращает именно те записи, что попали в промпт.
+    Сначала берутся материалы текущего запуска (всех его глав), а материалы прошлых запусков добавляются
+    в оставшийся бюджет только при EVIDENCE_REUSE_ENABLED."""
+    query = "\n".join([context['chapter_name'], context['chapter_description']] + queries)
+    hits = await recall(query, run_id=context['run_id'])
+    if EVIDENCE_REUSE_ENABLED:
+        used = sum(estimate_tokens(hit.text) for hit in hits)
+        hits += await recall(query, run_id=context['run_id'], other_runs=True,
+                             top_k=EVIDENCE_TOP_K - len(hits), token_budget=EVIDENCE_TOKEN_BUDGET - used)
+    context['evidence'] = render_evidence(hits, "") if len(hits) > 0 else None
+    return hits
+
+
+def chapter_fingerprint(run_id: str, chapter: Chapter, breadth_of_research, depth_of_research, relevancy_pass_rate,
+                        num_search_urls, num_search_arxiv) -> str:
+    """Ключ исследования главы. Включает run_id, чтобы одноименные главы разных исследований и пользователей
+    не делили чекпоинт, а внутри запуска исследование неизмененной главы переживало правку оглавления."""
+    return fingerprint({
+        'run_id': run_id,
+        'chapter_name': chapter.chapter_name,
+        'chapter_description': chapter.chapter_description,
+        'breadth': breadth_of_research,
+        'depth': depth_of_research,
+        'relevancy_pass_rate': relevancy_pass_rate,
+        'num_search_urls': num_search_urls,
+        'num_search_arxiv': num_search_arxiv,
+    })
+
+
+async def research_chapter(run_id: str, title: str, chapter: Chapter, breadth_of_research, depth_of_research, relevancy_pass_rate,
+                           num_search_urls, num_search_arxiv, progress, question_semaphore: asyncio.Semaphore,
+                           registry: UrlRegistry):
+    """Поиск и генерация гипотез для одной главы. Не зависит от других глав, поэтому главы исследуются параллельно.
+    Состояние сохраняется после каждого вопроса и раунда гипотез и восстанавливается при повторном запуске."""
+    # Все, что найдено в задаче главы, попадает в индекс с привязкой к запуску и главе
+    evidence_scope.set((run_id, chapter.chapter_name))
+    key = chapter_fingerprint(run_id, chapter, breadth_of_research, depth_of_research, relevancy_pass_rate, num_search_urls, num_search_arxiv)
+    state = await run_store.aload("chapters", key) or {}
+    summaries = state.get('summaries', [])
+    hypos = state.get('hypos', [])
+    visited_urls = state.get('visited_urls', [])
+    context = {
+        'run_id': run_id,
+        'title': title,
+        'chapter_name': chapter.chapter_name,
+        'chapter_description': chapter.chapter_description,
+        'visited_urls': visited_urls,
+        'summaries': summaries,
+        'hypos': hypos,
+        # Вопросы, на которые в этом запуске не удалось получить ответ
+        'failed_questions': [],
+        # В промпты идут не все саммари и гипотезы, а их дайджесты ограниченного размера
+        'summaries_digest': RollingDigest(f"{chapter.chapter_name}: summaries", SUMMARIES_TOKEN_BUDGET),
+        'hypos_digest': RollingDigest(f"{chapter.chapter_name}: hypos", HYPOS_TOKEN_BUDGET)
+    }
+    context['summaries_digest'].restore(state.get('summaries_digest'))
+    context['hypos_digest'].restore(state.get('hypos_digest'))
+    # Незавершенный раунд: заданные вопросы и уже полученные ответы по их номерам
+    done_depth = state.get('depth', 0)
+    questions = state.get('questions')
+    answers = state.get('answers', {})
+    if done_depth > 0 or len(answers) > 0:
+        print(f"Resuming chapter '{chapter.chapter_name}' from round {done_depth + 1}, {len(answers)} answers done")
+
+    async def checkpoint():
+        await run_store.asave("chapters", key, {
+            'chapter_name': chapter.chapter_name,
+            'depth': done_depth,
+            'questions': questions,
+            'answers': answers,
+            'summaries': summaries,
+            'hypos': hypos,
+            'visited_urls': visited_urls,
+            'summaries_digest': context['summaries_digest'].state(),
+            'hypos_digest': context['hypos_digest'].state(),
+        })
+
+    async def answer(depth, i, question, search_results):
+        if str(i) in answers:
+            return answers[str(i)]
+        async with question_semaphore:
+            progress(f"Глава '{chapter.chapter_name}', ищем ответ на вопрос '{question}'. Вопрос {depth * breadth_of_research + i + 1} из {depth_of_research * breadth_of_research}")
+            result = await answer_question(question, relevancy_pass_rate, num_search_urls, num_search_arxiv, registry, search_results)
+        if result is None:
+            # Вопрос пропускается, в чекпоинт ответ не пишется, чтобы при продолжении запуска попробовать снова
+            context['failed_questions'].append(question)
+            return [], []
+        answers[str(i)] = result
+        await checkpoint()
+        return result
+
+    if done_depth >= depth_of_research:
+        return context
+
+    async with chapter_research_semaphore:
+        for depth in range(done_depth, depth_of_research):
+            budget = current_budget()
+            if budget is not None and budget.exhausted():
+                print(f"Budget is almost exhausted, stopping research of chapter '{chapter.chapter_name}' after {depth} rounds: {budget.stats()}")
+                break
+            if questions is None:
+                # Когда бюджет на исходе, вопросов в раунде вдвое меньше
+                breadth = max(breadth_of_research // 2, 1) if budget is not None and budget.low() else breadth_of_research
+                await retrieve_evidence(context, hypos[-breadth_of_research:])
+                result = await run_agent(follow_up_questions_agent, [], context=context)
+                questions = FollowUpQuestions.model_validate(result).questions[:breadth]
+                await checkpoint()
+
+            # Выдача по всем вопросам раунда одним пакетом: параллельно, из кэша и без повторов страниц между вопросами
+            pending = [i for i in range(len(questions)) if str(i) not in answers]
+            round_results = [None] * len(questions)
+            if num_search_urls > 0 and len(pending) > 0:
+                for i, results in zip(pending, await search_many([questions[i] for i in pending], num_search_urls)):
+                    round_results[i] = results
+            question_answers = await asyncio.gather(*[answer(depth, i, question, round_results[i]) for i, question in enumerate(questions)])
+            # Результаты сливаются в порядке вопросов, а не в порядке завершения
+            for question_summaries, question_urls in question_answers:
+                summaries.extend(question_summaries)
+                visited_urls.extend(question_urls)
+                await context['summaries_digest'].add(question_summaries)
+
+            result = NewHypothesis.model_validate(await run_agent(hypos_agent, [], context=context))
+            hypos.extend(result.list_of_brilliant_ideas)
+            await context['hypos_digest'].add(result.list_of_brilliant_ideas)
+
+            done_depth = depth + 1
+            questions = None
+            answers = {}
+            await checkpoint()
+
+    return context
+
+
+async def write_research(table_of_concepts: TableOfConcepts, breadth_of_research, depth_of_research, relevancy_pass_rate,
+                         num_search_urls, num_search_arxiv, progress, run_id: str,
+                         on_chapter: Callable[[str], Awaitable] | None = None):
+    """Исследование глав идет параллельно, а редактура последовательно в порядке оглавления,
+    так как редактору главы нужен текст уже написанных глав.
+    on_chapter вызывается с markdown каждой главы сразу после ее написания (для уже написанных при продолжении запуска в начале),
+    и в конце со списком вопросов без ответа, если такие есть.
+    Запуск сохраняется под run_id после каждой главы. Повторный вызов с тем же run_id, оглавлением и параметрами
+    продолжает с последней написанной главы. Если оглавление или параметры поменялись, главы пишутся заново,
+    но исследование неизмененных глав берется из чекпоинтов."""
+    params = {
+        'table_of_concepts': table_of_concepts.model_dump(mode='json'),
+        'breadth': breadth_of_research,
+        'depth': depth_of_research,
+        'relevancy_pass_rate': relevancy_pass_rate,
+        'num_search_urls': num_search_urls,
+        'num_search_arxiv': num_search_arxiv,
+    }
+    run = await run_store.aload("runs", run_id)
+    if run is None or run['params'] != params:
+        run = {'run_id': run_id, 'created_at': time.time(), 'params': params, 'done_chapters': {},
+               'visited_urls': {}, 'failed_questions': {}, 'report_digest': None, 'final_research': None}
+    else:
+        print(f"Resuming run {run_id}: {len(run['done_chapters'])} chapters done")
+        if on_chapter is not None:
+            for chapter in table_of_concepts.chapters:
+                if chapter.chapter_name in run['done_chapters']:
+                    await on_chapter(print_chapter(chapter.chapter_name, run['visited_urls'].get(chapter.chapter_name, []),
+                                                   run['done_chapters'][chapter.chapter_name]))
+        if run['final_research'] is not None:
+            if on_chapter is not None and len(run['failed_questions']) > 0:
+                await on_chapter(print_failed_questions(run['failed_questions']))
+            return run['final_research']
+
+    # Бюджет на этот вызов, его видят все вызовы LLM внутри, включая задачи глав
+    budget = RunBudget()
+    # Потраченное до прерывания тоже считается
+    budget.tokens = run.get('spent_tokens', 0)
+    budget.cost = run.get('spent_cost', 0.0)
+    budget_token = run_budget.set(budget)
+    try:
+        return await write_chapters(table_of_concepts, breadth_of_research, depth_of_research, relevancy_pass_rate,
+                                    num_search_urls, num_search_arxiv, progress, run_id, run, on_chapter)
+    finally:
+        print(f"Run {run_id} budget: {budget.stats()}")
+        run_budget.reset(budget_token)
+
+
+async def write_chapters(table_of_concepts: TableOfConcepts, breadth_of_research, depth_of_research, relevancy_pass_rate,
+                         num_search_urls, num_search_arxiv, progress, run_id: str, run: dict,
+                         on_chapter: Callable[[str], Awaitable] | None):
+    """Исследование и редактура глав, которые еще не написаны в run."""
+    done_chapters = run['done_chapters']
+    dic_visited_urls = defaultdict(list, run['visited_urls'])
+    progress_counts = len(done_chapters)
+
+    def chapter_progress(desc):
+        progress(progress_counts / len(table_of_concepts.chapters), desc=desc)
+
+    # Ограничение на число одновременно обрабатываемых вопросов в рамках одного исследования
+    question_semaphore = asyncio.Semaphore(RUN_QUESTION_CONCURRENCY)
+    registry = UrlRegistry()
+    # Сжатое содержание уже написанных глав, которое видит редактор следующей главы
+    report_digest = RollingDigest(f"{table_of_concepts.title}: report", DONE_WORK_TOKEN_BUDGET)
+    report_digest.restore(run['report_digest'])
+
+    def done_work():
+        return f"# {table_of_concepts.title}\n{report_digest.render('Пока ничего не написано')}"
+
+    async def chapter_done(chapter_name, text, visited_urls, failed_questions):
+        done_chapters[chapter_name] = text
+        if len(failed_questions) > 0:
+            run['failed_questions'][chapter_name] = failed_questions
+        dic_visited_urls[chapter_name] = visited_urls
+        await report_digest.add([f"## {chapter_name}\n{text}"])
+        run['visited_urls'] = dict(dic_visited_urls)
+        run['spent_tokens'] = current_budget().tokens
+        run['spent_cost'] = current_budget().cost
+        run['report_digest'] = report_digest.state()
+        await run_store.asave("runs", run_id, run)
+        print(f"Chapter '{chapter_name}' is written: {len(text)} chars")
+        if on_chapter is not None:
+            await on_chapter(print_chapter(chapter_name, visited_urls, text))
+
+    research_chapters = [chapter for chapter in table_of_concepts.chapters
+                         if chapter.need_research and chapter.chapter_name not in done_chapters]
+    research_tasks = [
+        asyncio.create_task(research_chapter(run_id, table_of_concepts.title, chapter, breadth_of_research, depth_of_research,
+                                             relevancy_pass_rate, num_search_urls, num_search_arxiv, chapter_progress,
+                                             question_semaphore, registry))
+        for chapter in research_chapters
+    ]
+    try:
+        for chapter, research_task in zip(research_chapters, research_tasks):
+            context = await research_task
+            progress_counts += 1
+            chapter_progress(f"Пишем главу {chapter.chapter_name}")
+
+            context['done_work'] = done_work()
+            hits = await retrieve_evidence(context, context['hypos'])
+            # В список источников идут только фрагменты, попавшие в промпт редактора (других глав, а при
+            # EVIDENCE_REUSE_ENABLED и прошлых запусков)
+            context['visited_urls'].extend(hit.url for hit in hits if hit.url)
+            result = ChapterText.model_validate(await run_agent(chapter_editor_agent, [], context=context))
+            await chapter_done(chapter.chapter_name, result.chapter_text_without_title_in_head, context['visited_urls'], context['failed_questions'])
+    finally:
+        for research_task in research_tasks:
+            research_task.cancel()
+
+    for chapter in table_of_concepts.chapters:
+        if not chapter.need_research and chapter.chapter_name not in done_chapters:
+            progress_counts += 1
+            chapter_progress(f"Пишем главу {chapter.chapter_name}")
+            context = {
+                'title': table_of_concepts.title,
+                'chapter_name': chapter.chapter_name,
+                'chapter_description': chapter.chapter_description,
+                'done_work': done_work()
+            }
+            result = ChapterText.model_validate(await run_agent(chapter_editor_summary_agent, [], context=context))
+            await chapter_done(chapter.chapter_name, result.chapter_text_without_title_in_head, [], [])
+
+    print(f"Page cache stats: {page_cache.stats()}")
+    print(f"LLM cache stats: {llm_cache.stats()}")
+    print(f"arXiv cache stats: {arxiv_cache.stats()}")
+    print(f"Search cache stats: {search_cache.stats()}")
+    if EVIDENCE_INDEX_ENABLED:
+        print(f"Evidence index stats: {evidence_index.stats()}")
+    print(f"URL registry reused {registry.reused} results")
+    failed_questions = print_failed_questions(run['failed_questions'])
+    if on_chapter is not None and failed_questions:
+        await on_chapter(failed_questions)
+    run['final_research'] = get_research(table_of_concepts, dic_visited_urls, done_chapters, final=True) + failed_questions
+    await run_store.asave("runs", run_id, run)
+    return run['final_research']
+
+
+async def stream_research(table_of_concepts: TableOfConcepts, breadth_of_research, depth_of_research, relevancy_pass_rate,
+                          num_search_urls, num_search_arxiv, progress, run_id: str):
+    """write_research в виде асинхронного генератора: отдает пары (markdown, final) - главы по мере написания с final=False,
+    а в конце весь отчет в порядке оглавления с final=True (главы без исследования пишутся последними). Исследование идет в отдельной задаче, поэтому медленный потребитель его не тормозит,
+    а если потребитель перестал читать (например, закрыли вкладку), задача отменяется,
+    и исследование можно продолжить по run_id."""
+    queue = asyncio.Queue()
+    task = asyncio.create_task(write_research(table_of_concepts, breadth_of_research, depth_of_research, relevancy_pass_rate,
+                                              num_search_urls, num_search_arxiv, progress, run_id, on_chapter=queue.put))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while (chapter := await queue.get()) is not None:
+            yield chapter, False
+        yield await task, True
+    finally:
+        task.cancel()
@@ -51,8 +51,17 @@ class TableOfConceptsGuardrailAgent(Agent):
         )
 
 
+def evidence_section(context) -> str:
+    """Фрагменты источников из векторного индекса, отобранные под главу, в дополнение к дайджесту ее саммари."""
+    if not context.get('evidence'):
+        return ""
+    return f"""
+Фрагменты найденных источников (в квадратных скобках источник):
+{context['evidence']}
+"""
+
+
 def follow_up_questions_agent_sys_prompt(context, agent):
-    n = '\n'
     context = context.context
     return f"""
 На основе названия и описания главы исследовательской работы сгенерируй список релевантных и содержательных вопросов для поиска в интернете, 
@@ -62,12 +71,13 @@ def follow_up_questions_agent_sys_prompt(context, agent):
 Название главы: {context['chapter_name']}  
 Описание главы: {context['chapter_description']}
 Сырые мысли: 
-{n.join(context['summaries']) if len(context['summaries']) > 0 else "Пока мыслей нет"}
+{context['summaries_digest'].render("Пока мыслей нет")}
+{evidence_section(context)}
 
 
 
 Гипотезы: 
-{n.join(context['hypos']) if len(context['hypos']) > 0 else "Пока гипотез нет"}
+{context['hypos_digest'].render("Пока гипотез нет")}
 
 
 
@@ -108,7 +118,6 @@ class FollowUpQuestionsAgent(Agent):
 
 
 def hypos_generating_agent_sys_prompt(context, agent):
-    n = '\n'
     context = context.context
     return f"""
 На основе мыслей и гипотез которые у тебя есть сгенерируй список гипотез которые
@@ -118,12 +127,12 @@ def hypos_generating_agent_sys_prompt(context, agent):
 
 **Входные данные:**  
 Мысли: 
-{n.join(context['summaries']) if len(context['summaries']) > 0 else "Пока мыслей нет"}
+{context['summaries_digest'].render("Пока мыслей нет")}
 
 
 
 Гипотезы: 
-{n.join(context['hypos']) if len(context['hypos']) > 0 else "Пока гипотез нет"}
+{context['hypos_digest'].render("Пока гипотез нет")}
 
 Прежде чем ответить хорошо подумай шаг за шагом, воспроизводя цепочку рассужедний.
 Если в ходе рассуждений твои гипотезы повторяют входыне данные и ты не придумал ничего нового, то оставть список гипотез пустым. 
@@ -140,7 +149,6 @@ class HyposGeneratingAgent(Agent):
 
 
 def chapter_editor_agent_sys_prompt(context, agent):
-    n = '\n'
     context = context.context
     return f"""
 Ты редактор статей для научных журналов.
@@ -161,12 +169,13 @@ def chapter_editor_agent_sys_prompt(context, agent):
 
 
 НАРАБОТКИ КОЛЛЕГ: 
-{n.join(context['summaries']) if len(context['summaries']) > 0 else "Пока мыслей нет"}
+{context['summaries_digest'].render("Пока мыслей нет")}
+{evidence_section(context)}
 
 
 
 ГИПОТЕЗЫ КОЛЛЕГ: 
-{n.join(context['hypos']) if len(context['hypos']) > 0 else "Пока гипотез нет"}
+{context['hypos_digest'].render("Пока гипотез нет")}
 
 
 ДЛЯ НАПИСАНИЯ ГЛАВЫ ИСПОЛЬЗУЙ ФОРМАТ MARKDOWN. 
@@ -183,10 +192,7 @@ class ChapterEditorAgent(Agent):
 
 
 def chapter_editor_summary_agent_sys_prompt(context, agent):
-    n = '\n\n'
     context = context.context
-
-    chapters = [f"# Название главы: {chapter_name}\n\n# Текст главы:\n {chapter_text}" for chapter_name, chapter_text in context['done_chapters'].items()]
     return f"""
 Ты редактор статей для научных журналов.
 Твоя задача написать одну единственную главу под названием \"{context['chapter_name']}\" 
@@ -200,7 +206,7 @@ def chapter_editor_summary_agent_sys_prompt(context, agent):
 
 Написанные главы:  
 
-{n.join(chapters)}
+{context['done_work']}
 
 
 Для написания используй формат markdown. 
@@ -214,3 +220,17 @@ class ChapterEditorSummaryAgent(Agent):
             instructions=chapter_editor_summary_agent_sys_prompt,
             output_type=ChapterText
         )
+
+
+class DigestCompactionAgent(Agent):
+    def __init__(self):
+        super().__init__(
+            name="Digest compaction agent",
+            instructions="""
+Ты ведешь конспект исследовательской работы.
+Сожми присланные тексты (предыдущий конспект и новые заметки) в один связный конспект, уложившись в указанное ограничение по длине.
+Сохрани все факты, числа, определения, выводы, названия глав и ссылки на источники.
+Убери повторы, рекламу и общие фразы. Не добавляй ничего, чего нет в текстах.
+Ответь только текстом конспекта.
+            """
+        )
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+
+import aiohttp
+import arxiv
+import openai
+import requests
+from agents.exceptions import ModelBehaviorError
+from pydantic import ValidationError
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 4))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 1))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 30))
+# Общее время на все попытки одного вызова
+RETRY_DEADLINE = float(os.getenv("RETRY_DEADLINE", 300))
+# Сколько неудач подряд открывают цепь и сколько секунд она остается открытой
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 60))
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = RETRY_MAX_ATTEMPTS
+    base_delay: float = RETRY_BASE_DELAY
+    max_delay: float = RETRY_MAX_DELAY
+    deadline: float = RETRY_DEADLINE
+
+    def backoff(self, attempt: int) -> float:
+        """Экспоненциальная задержка с полным джиттером."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+@dataclass
+class ErrorClass:
+    # Имеет ли смысл повторять вызов
+    retryable: bool
+    # Говорит ли ошибка о проблеме сервиса (учитывается в circuit breaker), а не конкретного запроса
+    backend_fault: bool
+
+
+def status_class(status: int) -> ErrorClass:
+    # 429 - это исчерпанный лимит, а не отказ сервиса: его ждут повторы с Retry-After и rate limiter, а не circuit breaker
+    if status == 429:
+        return ErrorClass(retryable=True, backend_fault=False)
+    if status == 408 or status >= 500:
+        return ErrorClass(retryable=True, backend_fault=True)
+    if status in (401, 403):
+        return ErrorClass(retryable=False, backend_fault=True)
+    return ErrorClass(retryable=False, backend_fault=False)
+
+
+class ServiceError(Exception):
+    """Ошибка, о которой сервис сообщил в теле ответа (например, в строке NDJSON), с http статусом."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+def classify(e: BaseException) -> ErrorClass:
+    if isinstance(e, (openai.APIConnectionError, asyncio.TimeoutError, aiohttp.ClientConnectionError, ConnectionError,
+                      # Клиент arxiv ходит в сеть через requests
+                      requests.ConnectionError, requests.Timeout)):
+        return ErrorClass(retryable=True, backend_fault=True)
+    if isinstance(e, openai.APIStatusError):
+        return status_class(e.status_code)
+    if isinstance(e, aiohttp.ClientResponseError):
+        return status_class(e.status)
+    if isinstance(e, (arxiv.HTTPError, ServiceError)):
+        return status_class(e.status)
+    if isinstance(e, arxiv.UnexpectedEmptyPageError):
+        return ErrorClass(retryable=True, backend_fault=True)
+    # Модель ответила не по схеме: повторяем, но сервис исправен
+    if isinstance(e, (ModelBehaviorError, ValidationError, openai.LengthFinishReasonError)):
+        return ErrorClass(retryable=True, backend_fault=False)
+    return ErrorClass(retryable=False, backend_fault=False)
+
+
+def retry_after(e: BaseException) -> float | None:
+    """Задержка из заголовка Retry-After ответа с ошибкой, если он есть."""
+    headers = None
+    if isinstance(e, openai.APIStatusError):
+        headers = e.response.headers
+    elif isinstance(e, aiohttp.ClientResponseError):
+        headers = e.headers
+    if headers is None or headers.get("Retry-After") is None:
+        return None
+    value = headers.get("Retry-After")
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """После failure_threshold неудач подряд вызовы сервиса сразу падают с CircuitOpenError
+    в течение reset_timeout секунд, затем пропускается один пробный вызов."""
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial = False
+
+    def before_call(self):
+        if self.opened_at is None:
+            return
+        if time.monotonic() - self.opened_at < self.reset_timeout or self._trial:
+            raise CircuitOpenError(f"Circuit for {self.name} is open after {self.failures} failures")
+        self._trial = True
+
+    def release_trial(self):
+        """Освобождает пробный вызов полуоткрытой цепи, если он завершился без record_success/record_failure
+        (отмена или ошибка не сервиса), иначе цепь осталась бы открытой до перезапуска процесса."""
+        self._trial = False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            print(f"Circuit for {self.name} closed")
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                print(f"Circuit for {self.name} opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(backend: str) -> CircuitBreaker:
+    if backend not in breakers:
+        breakers[backend] = CircuitBreaker(backend)
+    return breakers[backend]
+
+
+async def call_with_retry(backend: str, call: Callable[[], Awaitable], policy: RetryPolicy | None = None):
+    """Вызывает call с повторами по политике и через circuit breaker сервиса backend.
+    Неповторяемые ошибки, исчерпанные попытки и открытая цепь пробрасываются вызывающему."""
+    policy = policy or RetryPolicy()
+    breaker = get_breaker(backend)
+    started_at = time.monotonic()
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await call()
+        except Exception as e:
+            error_class = classify(e)
+            if error_class.backend_fault:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            attempt += 1
+            if not error_class.retryable or attempt >= policy.max_attempts:
+                raise
+            delay = retry_after(e)
+            if delay is None:
+                delay = policy.backoff(attempt)
+            if time.monotonic() - started_at + delay > policy.deadline:
+                raise
+            print(f"{backend} call failed ({type(e).__name__}: {str(e)}), retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+        finally:
+            breaker.release_trial()
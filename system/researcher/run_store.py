@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+RUNS_DIR = os.getenv("RUNS_DIR", os.path.join(CACHE_DIR, "runs"))
+# run_id приходит от пользователя и становится именем файла, поэтому допускаются только безопасные символы
+RUN_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex
+
+
+def check_run_id(run_id: str) -> str:
+    if not re.fullmatch(RUN_ID_PATTERN, run_id):
+        raise ValueError(f"Некорректный идентификатор исследования {run_id!r}: допускаются латинские буквы, цифры, '_' и '-', не больше 64 символов")
+    return run_id
+
+
+def fingerprint(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+class RunStore:
+    """Чекпоинты исследований в json файлах.
+    runs/<run_id>.json хранит состояние запуска: оглавление, параметры и написанные главы.
+    chapters/<fingerprint>.json хранит исследование главы (вопросы, ответы, саммари, гипотезы),
+    fingerprint зависит от run_id, главы и параметров поиска, поэтому исследование главы
+    переиспользуется при продолжении запуска, даже если пользователь поменял часть оглавления."""
+
+    def __init__(self, runs_dir: str):
+        self.runs_dir = runs_dir
+        self._lock = threading.Lock()
+        # Версии снимков: записи идут в потоках и могут завершиться не в том порядке, в котором сделаны снимки
+        self._versions = itertools.count()
+        self._written: dict[tuple[str, str], int] = {}
+        for kind in ("runs", "chapters"):
+            os.makedirs(os.path.join(runs_dir, kind), exist_ok=True)
+
+    def _path(self, kind: str, key: str) -> str:
+        kind_dir = os.path.realpath(os.path.join(self.runs_dir, kind))
+        path = os.path.realpath(os.path.join(kind_dir, f"{check_run_id(key)}.json"))
+        assert os.path.dirname(path) == kind_dir, f"Checkpoint path {path} is outside of {kind_dir}"
+        return path
+
+    def load(self, kind: str, key: str) -> dict | None:
+        try:
+            with open(self._path(kind, key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError as e:
+            print(f"Broken checkpoint {kind}/{key}: {str(e)}")
+            return None
+
+    def save(self, kind: str, key: str, data: str, version: int | None = None):
+        # Пишем во временный файл и подменяем, чтобы падение посреди записи не портило чекпоинт
+        path = self._path(kind, key)
+        if version is None:
+            version = next(self._versions)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        with self._lock:
+            # Более новый снимок уже записан, старый его не перезаписывает
+            if self._written.get((kind, key), -1) > version:
+                os.remove(temp_path)
+                return
+            os.replace(temp_path, path)
+            self._written[(kind, key)] = version
+
+    async def aload(self, kind: str, key: str) -> dict | None:
+        return await asyncio.to_thread(self.load, kind, key)
+
+    async def asave(self, kind: str, key: str, state: dict):
+        # Сериализуем и берем версию сразу, чтобы в файл попал снимок состояния на момент чекпоинта
+        state = dict(state, updated_at=time.time())
+        version = next(self._versions)
+        await asyncio.to_thread(self.save, kind, key, json.dumps(state, ensure_ascii=False), version)
+
+
+run_store = RunStore(RUNS_DIR)
@@ -3,6 +3,8 @@ from typing import Optional
 
 from pydantic import BaseModel, Field
 
+from run_store import RUN_ID_PATTERN
+
 
 class RelevanceScoreNumber(int, Enum):
     """Оценка релевантности  (0-10)."""
@@ -60,6 +62,16 @@ class RelevanceScore(BaseModel):
     relevance_score: RelevanceScoreNumber
 
 
+class ArticleRelevanceScore(BaseModel):
+    article_number: int
+    reasoning: str
+    relevance_score: RelevanceScoreNumber
+
+
+class ArticlesRelevanceScores(BaseModel):
+    scores: list[ArticleRelevanceScore]
+
+
 class ChapterText(BaseModel):
     chapter_title: str
     chapter_text_without_title_in_head: str
@@ -78,3 +90,14 @@ class NeedRewriteTableOfConcepts(BaseModel):
 
 class SearchWords(BaseModel):
     words: list[str]
+
+
+class ResearchRequest(BaseModel):
+    table_of_concepts: TableOfConcepts
+    breadth_of_research: int = 2
+    depth_of_research: int = 2
+    relevancy_pass_rate: int = 7
+    num_search_urls: int = 5
+    num_search_arxiv: int = 3
+    # Тот же run_id продолжает исследование с чекпоинта
+    run_id: Optional[str] = Field(default=None, pattern=RUN_ID_PATTERN)
@@ -0,0 +1,24 @@
+import asyncio
+
+import compaction
+from compaction import RollingDigest
+from relevance import CHARS_PER_TOKEN
+
+
+def test_oversized_item_keeps_digest_target(monkeypatch):
+    calls = []
+
+    async def fake_run_agent(agent, input, context=None, use_cache=True):
+        calls.append(input)
+        return "конспект " * 1000
+
+    monkeypatch.setattr(compaction, "run_agent", fake_run_agent)
+    digest = RollingDigest("report", 6000)
+    digest.recent = ["предыдущая глава " * 200]
+    # Одна запись больше половины бюджета
+    asyncio.run(digest.add(["длинная глава " * 4000]))
+
+    assert len(calls) == 1
+    assert digest.recent == []
+    # Цель сжатия не ниже четверти бюджета, а не 8 символов
+    assert len(digest.digest) >= 6000 // 4 * CHARS_PER_TOKEN
@@ -0,0 +1,12 @@
+from urls import arxiv_pdf_url, dedupe_urls, normalize_url
+
+
+def test_normalize_url_keeps_malformed_url():
+    assert normalize_url(" https://example.com:port/x ") == "https://example.com:port/x"
+    assert normalize_url("http://[::1/x") == "http://[::1/x"
+    assert arxiv_pdf_url("http://[::1/x") == "http://[::1/x"
+
+
+def test_dedupe_urls_with_malformed_url():
+    urls = ["https://example.com:port/x", "http://Example.com/a/?utm_source=x", "https://example.com/a"]
+    assert dedupe_urls(urls) == ["https://example.com:port/x", "http://Example.com/a/?utm_source=x"]
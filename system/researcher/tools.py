@@ -1,21 +1,81 @@
+import asyncio
 import os
 
-import requests
-from agents import Runner, function_tool
-from markdownify import markdownify
-import re
+import aiohttp
+from agents import function_tool
 from agents import Agent
-from requests import RequestException
 
+from arxiv_search import search_arxiv
+from budget import current_budget
+from evidence_index import remember_page
+from extraction import html_to_markdown
+from http_client import get_session, http_timeout, iter_ndjson
+from llm import run_agent
+from page_cache import page_cache
+from resilience import call_with_retry, classify, get_breaker, status_class, ServiceError
+from relevance import prefilter, rank_by_coverage, select_relevant_chunks
+from web_search import searxng_search
+from urls import UrlRegistry, arxiv_pdf_url, dedupe_urls, normalize_url
 from structured_outputs import SummaryWithInterestingUrls, RelevanceScore, SearchWords, \
-    TableOfConcepts
-import arxiv
+    TableOfConcepts, ArticlesRelevanceScores
 
-SEARXNG_SEARCH_URL = os.getenv("SEARXNG_SEARCH_URL", "http://localhost:8080/search")
 PARSE_PDF_URL = os.getenv("PARSE_PDF_URL", "http://localhost:8000/extract-text")
+PARSE_PDF_BATCH_URL = os.getenv("PARSE_PDF_BATCH_URL", f"{PARSE_PDF_URL}/batch")
+PARSE_PDF_STREAM_URL = os.getenv("PARSE_PDF_STREAM_URL", f"{PARSE_PDF_URL}/stream")
 MAX_CONTENT_LEN = int(os.getenv("MAX_CONTENT_LEN", 200000))
+# Не меньше CONVERSION_TIMEOUT сервиса pdf-parser, иначе клиент бросает ответ, пока PDF еще конвертируется
+PARSE_PDF_READ_TIMEOUT = float(os.getenv("PARSE_PDF_READ_TIMEOUT", 900))
+ARXIV_RELEVANCE_MODE = os.getenv("ARXIV_RELEVANCE_MODE", "batch")
+ARXIV_RELEVANCE_BATCH_SIZE = int(os.getenv("ARXIV_RELEVANCE_BATCH_SIZE", 5))
+SEARCH_WEB_CONCURRENCY = int(os.getenv("SEARCH_WEB_CONCURRENCY", 5))
+GLOBAL_WEB_CONCURRENCY = int(os.getenv("GLOBAL_WEB_CONCURRENCY", 20))
 
-client = arxiv.Client()
+global_web_semaphore = asyncio.Semaphore(GLOBAL_WEB_CONCURRENCY)
+
+# Общие критерии для поштучной и пакетной оценки, чтобы оценки были сопоставимы
+ARTICLE_RELEVANCE_CRITERIA = """## Критерии оценки:
+
+### 0 баллов:
+- Аннотация не содержит информации, связанной с вопросом.
+- Ключевые аспекты вопроса полностью игнорируются.
+Пример: 
+Вопрос: "Как ИИ улучшает диагностику рака?"  
+Аннотация: "Исследование влияния диеты на уровень холестерина".
+
+### 1-3 балла:
+- Упоминаются смежные понятия, но прямой ответ на вопрос отсутствует.
+- Нет данных, методов или выводов, релевантных вопросу.
+Пример: 
+Вопрос: "Каковы риски блокчейна для банков?"  
+Аннотация: "Обзор технологий распределенного реестра".
+
+### 4-5 баллов:
+- Есть косвенная связь с вопросом, но ответ неполный или поверхностный.
+- Затрагивается лишь часть вопроса без детализации.
+Пример: 
+Вопрос: "Почему нейросети хуже распознают редкие заболевания?"  
+Аннотация: "Рассмотрены ограничения ИИ в медицине".
+
+### 6-7 баллов:
+- Аннотация частично отвечает на вопрос, но с пробелами.
+- Указаны некоторые релевантные данные, но без глубины анализа.
+Пример: 
+Вопрос: "Как климат влияет на миграцию птиц в Европе?"  
+Аннотация: "Исследование сезонной миграции воробьиных (без привязки к климату)".
+
+### 8-9 баллов:
+- Четкий ответ на вопрос с аргументацией или данными.
+- Не хватает лишь небольших уточнений или примеров.
+Пример: 
+Вопрос: "Какие алгоритмы машинного обучения эффективны для прогнозирования цен на нефть?"  
+Аннотация: "Сравнение LSTM и Random Forest для прогнозирования цен на нефть (точность LSTM — 89%)".
+
+### 10 баллов:
+- Полный и исчерпывающий ответ на вопрос.
+- Включены: методы, результаты, выводы и значимость именно для заданного вопроса.
+Пример: 
+Вопрос: "Как социальные сети влияют на тревожность у подростков?"  
+Аннотация: "Лонгитюдное исследование 1000 подростков показало, что ежедневное использование соцсетей >3 часов увеличивает тревожность на 40% (p < 0.01), особенно у девушек"."""
 
 
 @function_tool
@@ -29,10 +89,12 @@ async def final_answer_table_of_concepts(answer: TableOfConcepts) -> TableOfConc
     return answer
 
 
-async def search_web(query: str, relevancy_pass_rate: int, num_search: int, visited_urls: list[str]):
+async def search_web(query: str, relevancy_pass_rate: int, num_search: int, visited_urls: list[str],
+                     registry: UrlRegistry | None = None, results: list[dict] | None = None):
     """Используй для поиска инфорации в интернете
         Args:
         query: запрос
+        results: готовая выдача по запросу (например, из web_search.search_many), иначе выполняется поиск
 
         Returns:
             Поисковая выдача
@@ -40,26 +102,53 @@ async def search_web(query: str, relevancy_pass_rate: int, num_search: int, visi
     if num_search == 0:
         return
 
-    results = searxng_search(keywords=query, max_results=num_search)
-    summaries = []
-
-    for result in results:
-        summary = await visit_webpage_and_summarize(result['url'], query)
+    if registry is None:
+        registry = UrlRegistry()
+    if results is None:
+        results = await searxng_search(keywords=query, max_results=num_search)
+    question_semaphore = asyncio.Semaphore(SEARCH_WEB_CONCURRENCY)
+    # Одна и та же страница (с точностью до normalize_url) посещается в рамках вопроса один раз
+    seen_urls = set()
+
+    def claim(url):
+        key = normalize_url(url)
+        if key in seen_urls:
+            return False
+        seen_urls.add(key)
+        return True
+
+    async def visit(url):
+        async with question_semaphore, global_web_semaphore:
+            summary = await visit_webpage_and_summarize(url, query, registry)
         if summary is not None and summary.relevance_score >= relevancy_pass_rate:
-            visited_urls.append(result['url'])
-            summaries.append(summary)
-
-    all_interesting_urls = []
+            # Страница уже скачана, registry отдаст ее без повторной загрузки
+            content = await registry.content(url, lambda: load_webpage_content(arxiv_pdf_url(url)))
+            await remember_page(query, url, summary.summary, content)
+            return summary
+
+    async def visit_with_interesting_urls(url):
+        summary = await visit(url)
+        if summary is None:
+            return None, []
+
+        # Переходы по интересным ссылкам стартуют сразу, как только готово саммари родительской страницы
+        # Когда бюджет исследования на исходе, по ссылкам со страниц не переходим
+        budget = current_budget()
+        if budget is not None and budget.low():
+            return (url, summary), []
+        interesting_urls = [x.web_page_url for x in summary.interesting_web_page_urls if x.question_and_url_relevant_score >= relevancy_pass_rate and claim(x.web_page_url)]
+        interesting_summaries = await asyncio.gather(*[visit(interesting_url) for interesting_url in interesting_urls])
+        return (url, summary), [(interesting_url, interesting_summary) for interesting_url, interesting_summary in zip(interesting_urls, interesting_summaries) if interesting_summary is not None]
+
+    first_hop_urls = [result['url'] for result in results if claim(result['url'])]
+    hops = await asyncio.gather(*[visit_with_interesting_urls(url) for url in first_hop_urls])
+    first_hop = [page for page, _ in hops if page is not None]
+    second_hop = [page for _, pages in hops for page in pages]
 
-    for summary in summaries:
-        all_interesting_urls.extend(
-            [x.web_page_url for x in summary.interesting_web_page_urls if x.question_and_url_relevant_score >= relevancy_pass_rate])
-
-    for url in all_interesting_urls:
-        summary = await visit_webpage_and_summarize(url, query)
-        if summary is not None and summary.relevance_score >= relevancy_pass_rate:
-            visited_urls.append(url)
-            summaries.append(summary)
+    summaries = []
+    for url, summary in first_hop + second_hop:
+        visited_urls.append(url)
+        summaries.append(summary)
 
     if list(summaries) == 0:
         return None
@@ -67,7 +156,7 @@ async def search_web(query: str, relevancy_pass_rate: int, num_search: int, visi
     return await summarize_texts(query, summaries)
 
 
-async def visit_webpage_and_summarize(url: str, query: str):
+async def visit_webpage_and_summarize(url: str, query: str, registry: UrlRegistry | None = None):
     # """Посещение веб-страницы по URL и возвращение ее контента в markdown
     #
     # Args:
@@ -77,45 +166,125 @@ async def visit_webpage_and_summarize(url: str, query: str):
     #     Контент веб-страницы в markdown, или ошибка если запрос выполнился некорректно
     # """
 
-    if url.startswith("https://arxiv.org/abs/"):
-        url = url.replace("abs", "pdf")
+    url = arxiv_pdf_url(url)
+    if registry is None:
+        registry = UrlRegistry()
 
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        content = None
-
-        if response.headers['content-type'] == 'application/pdf':
-            content = await parse_pdf(url)
-        else:
-            markdown_content = markdownify(response.text).strip()
-            content = re.sub(r"\n{3,}", "\n\n", markdown_content)
-
-        if content is None:
+        # Скачивание страницы общее для всех вопросов исследования, а саммари свое под каждый вопрос
+        content = await registry.content(url, lambda: load_webpage_content(url))
+        if content is None or not prefilter(query, content, url):
             return
 
-        return await summarize_content(query, url, content, "веб страница")
-    except RequestException as e:
+        return await registry.summary(url, query, lambda: summarize_content(query, url, content, "веб страница"))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         print(f"Error fetching the webpage {url}: {str(e)}")
     except Exception as e:
         print(f"An unexpected error occurred {url}: {str(e)}")
 
 
-def searxng_search(keywords, max_results):
-    response = requests.get(f"{SEARXNG_SEARCH_URL}?q={keywords}&format=json", timeout=30)
-    response.raise_for_status()
-    return response.json()['results'][:max_results]
+async def load_webpage_content(url: str):
+    cached = await page_cache.aget(url)
+    if cached is not None:
+        return cached.markdown
+    return await fetch_webpage_content(url)
+
+
+async def fetch_webpage_content(url: str):
+    async with get_session().get(url) as response:
+        response.raise_for_status()
+        if response.content_type == 'application/pdf':
+            body = None
+        else:
+            body = await response.read()
+            html = body.decode(response.charset or 'utf-8', errors='replace')
+
+    if body is None:
+        text = await call_with_retry("pdf_parser", lambda: request_pdf_text(url))
+        await page_cache.aput(url, 'application/pdf', text)
+        return text
+
+    content = await asyncio.to_thread(html_to_markdown, html, url)
+    await page_cache.aput(url, 'text/html', content, body)
+    return content
 
 
 async def parse_pdf(url: str):
     try:
-        response = requests.post(PARSE_PDF_URL, json={"url": url}, timeout=300)
-        return response.json()['text']
+        cached = await page_cache.aget(url)
+        if cached is not None:
+            return cached.markdown
+
+        text = await call_with_retry("pdf_parser", lambda: request_pdf_text(url))
+        await page_cache.aput(url, 'application/pdf', text)
+        return text
     except Exception as e:
         print(f"An unexpected error occurred while parse_pdf {url}: {str(e)}")
 
 
-async def search_arxiv_relevant_pdfs_and_summarize(question: str, relevancy_pass_rate: int, num_search: int, visited_urls: list[str]):
+async def request_pdf_text(url: str, max_chars: int = MAX_CONTENT_LEN) -> str:
+    texts = []
+    async for text in stream_pdf_pages(url, max_chars):
+        texts.append(text)
+    return "\n\n".join(texts)[:max_chars]
+
+
+async def stream_pdf_pages(url: str, max_chars: int = MAX_CONTENT_LEN, page_range: str | None = None):
+    """Отдает текст PDF кусками страниц по мере конвертации.
+    Сервис сам останавливается на max_chars, а если выйти из цикла раньше, то оставшиеся страницы не конвертируются."""
+    payload = {"url": url, "max_chars": max_chars, "page_range": page_range}
+    async with get_session().post(PARSE_PDF_STREAM_URL, json=payload, timeout=http_timeout(read=PARSE_PDF_READ_TIMEOUT)) as response:
+        response.raise_for_status()
+        async for result in iter_ndjson(response):
+            if 'error' in result:
+                raise ServiceError(f"PDF parser error {result['status_code']}: {result['error']}", result['status_code'])
+            yield result['text']
+
+
+async def parse_pdfs(urls: list[str]):
+    """Распознает несколько PDF одним запросом к /extract-text/batch.
+    Отдает пары (url, текст) по мере готовности, для PDF которые не удалось распознать текст None.
+    PDF, упавшие с временной ошибкой или не полученные из-за обрыва batch запроса, повторяются по одному через call_with_retry."""
+    missing = []
+    for url in dict.fromkeys(urls):
+        cached = await page_cache.aget(url)
+        if cached is not None:
+            yield url, cached.markdown
+        else:
+            missing.append(url)
+
+    if len(missing) == 0:
+        return
+
+    pending = dict.fromkeys(missing)
+    breaker = get_breaker("pdf_parser")
+    try:
+        breaker.before_call()
+        async with get_session().post(PARSE_PDF_BATCH_URL, json={"urls": missing, "max_chars": MAX_CONTENT_LEN}, timeout=http_timeout(read=PARSE_PDF_READ_TIMEOUT)) as response:
+            response.raise_for_status()
+            breaker.record_success()
+            async for result in iter_ndjson(response):
+                if 'text' in result:
+                    pending.pop(result['url'], None)
+                    await page_cache.aput(result['url'], 'application/pdf', result['text'])
+                    yield result['url'], result['text']
+                elif not status_class(result['status_code']).retryable:
+                    pending.pop(result['url'], None)
+                    print(f"An unexpected error occurred while parse_pdf {result['url']}: {result['error']}")
+                    yield result['url'], None
+    except Exception as e:
+        if classify(e).backend_fault:
+            breaker.record_failure()
+        print(f"An unexpected error occurred while parse_pdfs {missing}: {str(e)}")
+    finally:
+        breaker.release_trial()
+
+    for url in pending:
+        yield url, await parse_pdf(url)
+
+
+async def search_arxiv_relevant_pdfs_and_summarize(question: str, relevancy_pass_rate: int, num_search: int, visited_urls: list[str],
+                                                   registry: UrlRegistry | None = None):
     question_to_words_agent = Agent(
         name="Questions to words agent",
         instructions=f"""
@@ -140,100 +309,122 @@ async def search_arxiv_relevant_pdfs_and_summarize(question: str, relevancy_pass
     if num_search == 0:
         return
 
-    agent_result = await Runner.run(question_to_words_agent, [])
-    words = SearchWords.model_validate(agent_result.final_output).words
+    words = SearchWords.model_validate(await run_agent(question_to_words_agent, [])).words
     articles = await search_arxiv_relevant_pdfs(words, question, num_search)
+    if registry is None:
+        registry = UrlRegistry()
+    pdf_urls = dedupe_urls([article['pdf_url'] for article in articles if article['relevance_score'] >= relevancy_pass_rate])
+
+    # Саммари каждой статьи запускается сразу как только готов ее текст
+    summary_tasks = {}
+    contents = {}
+    async for pdf_url, content in parse_pdfs(pdf_urls):
+        if content is not None:
+            contents[pdf_url] = content
+            summary_tasks[pdf_url] = asyncio.create_task(registry.summary(
+                pdf_url, question, lambda pdf_url=pdf_url, content=content: summarize_content(question, pdf_url, content, "статья из научного журнала")
+            ))
+
+    pdf_summaries = dict(zip(summary_tasks, await asyncio.gather(*summary_tasks.values())))
     summaries = []
-    for article in articles:
-        if article['relevance_score'] >= relevancy_pass_rate:
-            content = await parse_pdf(article['pdf_url'])
-            if content is not None:
-                summary = await summarize_content(question, article['pdf_url'], content, "статья из научного журнала")
-                if summary.relevance_score >= relevancy_pass_rate:
-                    summaries.append(summary)
-                    visited_urls.append(article['pdf_url'])
+    for pdf_url in pdf_urls:
+        if pdf_url in pdf_summaries:
+            summary = pdf_summaries[pdf_url]
+            if summary.relevance_score >= relevancy_pass_rate:
+                summaries.append(summary)
+                visited_urls.append(pdf_url)
+                await remember_page(question, pdf_url, summary.summary, contents[pdf_url])
 
     return await summarize_texts(question, summaries)
 
 
 async def search_arxiv_relevant_pdfs(search_words: list[str], question: str, max_results: int):
     words = ' '.join(search_words)
-    search = arxiv.Search(
-        query=f'ti:{words} AND abs:{words}',
-        max_results=max_results,
-        sort_by=arxiv.SortCriterion.Relevance
-    )
+    articles = await search_arxiv(search_words, max_results)
+    # Аннотации без ключевых слов запроса не отправляются на оценку в LLM
+    ranked = rank_by_coverage(words, [article.summary for article in articles], [article.pdf_url for article in articles])
+    articles = [articles[i] for i in ranked]
+    scores = await score_articles_relevance(question, [article.summary for article in articles])
+
     results = []
-    for result in client.results(search):
-        article_relevance_agent = Agent(
-            name="Article relevance agent",
-            instructions=f"""
-Ты — эксперт в анализе научных и публицистических текстов. Оцени, насколько аннотация статьи отвечает на **конкретный вопрос**, используя шкалу от 0 до 10. 
+    for article, relevance_score in zip(articles, scores):
+        results.append({
+            'title': article.title,
+            'pdf_url': article.pdf_url,
+            'abstract': article.summary,
+            'relevance_score': relevance_score
+        })
+    return results
 
-## Критерии оценки:
 
-### 0 баллов:
-- Аннотация не содержит информации, связанной с вопросом.
-- Ключевые аспекты вопроса полностью игнорируются.
-Пример: 
-Вопрос: "Как ИИ улучшает диагностику рака?"  
-Аннотация: "Исследование влияния диеты на уровень холестерина".
+async def score_articles_relevance(question: str, abstracts: list[str]) -> list[int]:
+    """Оценка релевантности аннотаций вопросу.
+    В режиме batch одним запросом оценивается до ARXIV_RELEVANCE_BATCH_SIZE аннотаций,
+    а аннотации, которые модель пропустила, доцениваются по одной."""
+    if ARXIV_RELEVANCE_MODE != 'batch' or ARXIV_RELEVANCE_BATCH_SIZE <= 1:
+        return await asyncio.gather(*[score_article_relevance(question, abstract) for abstract in abstracts])
 
-### 1-3 балла:
-- Упоминаются смежные понятия, но прямой ответ на вопрос отсутствует.
-- Нет данных, методов или выводов, релевантных вопросу.
-Пример: 
-Вопрос: "Каковы риски блокчейна для банков?"  
-Аннотация: "Обзор технологий распределенного реестра".
+    batches = [abstracts[i:i + ARXIV_RELEVANCE_BATCH_SIZE] for i in range(0, len(abstracts), ARXIV_RELEVANCE_BATCH_SIZE)]
+    batch_scores = await asyncio.gather(*[score_articles_relevance_batch(question, batch) for batch in batches])
+    scores = [score for batch in batch_scores for score in batch]
 
-### 4-5 баллов:
-- Есть косвенная связь с вопросом, но ответ неполный или поверхностный.
-- Затрагивается лишь часть вопроса без детализации.
-Пример: 
-Вопрос: "Почему нейросети хуже распознают редкие заболевания?"  
-Аннотация: "Рассмотрены ограничения ИИ в медицине".
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if len(missing) > 0:
+        print(f"Article relevance batch fallback for {len(missing)} of {len(abstracts)} abstracts")
+        fallback_scores = await asyncio.gather(*[score_article_relevance(question, abstracts[i]) for i in missing])
+        for i, score in zip(missing, fallback_scores):
+            scores[i] = score
+    return scores
 
-### 6-7 баллов:
-- Аннотация частично отвечает на вопрос, но с пробелами.
-- Указаны некоторые релевантные данные, но без глубины анализа.
-Пример: 
-Вопрос: "Как климат влияет на миграцию птиц в Европе?"  
-Аннотация: "Исследование сезонной миграции воробьиных (без привязки к климату)".
 
-### 8-9 баллов:
-- Четкий ответ на вопрос с аргументацией или данными.
-- Не хватает лишь небольших уточнений или примеров.
-Пример: 
-Вопрос: "Какие алгоритмы машинного обучения эффективны для прогнозирования цен на нефть?"  
-Аннотация: "Сравнение LSTM и Random Forest для прогнозирования цен на нефть (точность LSTM — 89%)".
+async def score_article_relevance(question: str, abstract: str) -> int:
+    article_relevance_agent = Agent(
+        name="Article relevance agent",
+        instructions=f"""
+Ты — эксперт в анализе научных и публицистических текстов. Оцени, насколько аннотация статьи отвечает на **конкретный вопрос**, используя шкалу от 0 до 10. 
 
-### 10 баллов:
-- Полный и исчерпывающий ответ на вопрос.
-- Включены: методы, результаты, выводы и значимость именно для заданного вопроса.
-Пример: 
-Вопрос: "Как социальные сети влияют на тревожность у подростков?"  
-Аннотация: "Лонгитюдное исследование 1000 подростков показало, что ежедневное использование соцсетей >3 часов увеличивает тревожность на 40% (p < 0.01), особенно у девушек".
+{ARTICLE_RELEVANCE_CRITERIA}
+## Запрос на оценку:
+**Вопрос:** {question}
+**Аннотация:** {abstract}
+            """,
+        output_type=RelevanceScore
+    )
+    return RelevanceScore.model_validate(await run_agent(article_relevance_agent, [])).relevance_score
+
+
+async def score_articles_relevance_batch(question: str, abstracts: list[str]) -> list[int | None]:
+    n = '\n\n'
+    articles = [f"### Аннотация {i + 1}\n{abstract}" for i, abstract in enumerate(abstracts)]
+    articles_relevance_agent = Agent(
+        name="Articles batch relevance agent",
+        instructions=f"""
+Ты — эксперт в анализе научных и публицистических текстов. Оцени, насколько КАЖДАЯ аннотация статьи НЕЗАВИСИМО от остальных отвечает на **конкретный вопрос**, используя шкалу от 0 до 10. 
+Для каждой аннотации верни отдельную оценку и в поле article_number укажи ее номер.
 
+{ARTICLE_RELEVANCE_CRITERIA}
 ## Запрос на оценку:
 **Вопрос:** {question}
-**Аннотация:** {result.summary}
+
+{n.join(articles)}
             """,
-            output_type=RelevanceScore
-        )
-        agent_result = await Runner.run(article_relevance_agent, [])
+        output_type=ArticlesRelevanceScores
+    )
+    try:
+        result = ArticlesRelevanceScores.model_validate(await run_agent(articles_relevance_agent, []))
+    except Exception as e:
+        print(f"Article relevance batch failed: {str(e)}")
+        return [None] * len(abstracts)
 
-        results.append({
-            'title': result.title,
-            'pdf_url': result.pdf_url,
-            'abstract': result.summary,
-            'relevance_score': RelevanceScore.model_validate(agent_result.final_output).relevance_score
-        })
-    return results
+    scores = [None] * len(abstracts)
+    for score in result.scores:
+        if 1 <= score.article_number <= len(abstracts):
+            scores[score.article_number - 1] = score.relevance_score
+    return scores
 
 
 async def summarize_content(query: str, url: str, content: str, source: str) -> SummaryWithInterestingUrls:
-    if len(content) > MAX_CONTENT_LEN:
-        content = content[:MAX_CONTENT_LEN]
+    content = select_relevant_chunks(query, content)
 
     search_summary_agent = Agent(
         name="Web page summary agent",
@@ -270,8 +461,7 @@ async def summarize_content(query: str, url: str, content: str, source: str) ->
             """,
         output_type=SummaryWithInterestingUrls
     )
-    result = await Runner.run(search_summary_agent, [])
-    result = SummaryWithInterestingUrls.model_validate(result.final_output)
+    result = SummaryWithInterestingUrls.model_validate(await run_agent(search_summary_agent, []))
     if result.interesting_web_page_urls is None:
         result.interesting_web_page_urls = []
     return result
@@ -294,5 +484,4 @@ async def summarize_texts(query: str, summaries: list[SummaryWithInterestingUrls
 {n.join([summary.summary for summary in summaries])}
             """,
     )
-    result = await Runner.run(summary_agent, [])
-    return result.final_output
+    return await run_agent(summary_agent, [])
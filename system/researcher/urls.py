@@ -0,0 +1,78 @@
+import asyncio
+from typing import Awaitable, Callable
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+TRACKING_PARAMS = {'fbclid', 'gclid', 'yclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', '_ga', '_gl', 'spm', 'ref', 'ref_src', 'igshid'}
+
+
+def arxiv_pdf_url(url: str) -> str:
+    """Ссылку на страницу статьи arxiv заменяет ссылкой на ее PDF."""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    if parts.hostname in ('arxiv.org', 'www.arxiv.org', 'export.arxiv.org') and parts.path.startswith('/abs/'):
+        return urlunsplit(('https', 'arxiv.org', '/pdf/' + parts.path[len('/abs/'):], parts.query, ''))
+    return url
+
+
+def normalize_url(url: str) -> str:
+    """Приводит url к каноничному виду, чтобы одна и та же страница имела один ключ:
+    https вместо http, хост в нижнем регистре, без порта по умолчанию, фрагмента, слэша на конце,
+    трекинговых параметров, с отсортированными параметрами и abs ссылками arxiv замененными на pdf.
+    Некорректный url (например, с нечисловым портом) возвращается как есть, без пробелов по краям."""
+    try:
+        parts = urlsplit(arxiv_pdf_url(url.strip()))
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        host = f"{host}:{port}"
+    if scheme == 'http':
+        scheme = 'https'
+    path = parts.path.rstrip('/') or '/'
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS]
+    return urlunsplit((scheme, host, path, urlencode(sorted(query)), ''))
+
+
+def dedupe_urls(urls: list[str]) -> list[str]:
+    """Убирает повторы с точностью до normalize_url, сохраняя первое вхождение."""
+    seen = set()
+    result = []
+    for url in urls:
+        key = normalize_url(url)
+        if key not in seen:
+            seen.add(key)
+            result.append(url)
+    return result
+
+
+class UrlRegistry:
+    """Реестр работы с url в рамках одного исследования.
+    Одинаковая работа (скачивание страницы, саммари страницы под конкретный вопрос) выполняется один раз:
+    одновременные запросы ждут одну и ту же задачу, а последующие получают готовый результат."""
+
+    def __init__(self):
+        self._tasks: dict[tuple, asyncio.Task] = {}
+        self.reused = 0
+
+    async def run_once(self, key: tuple, factory: Callable[[], Awaitable]):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._tasks[key] = task
+            # Упавшую задачу не запоминаем, чтобы ее можно было повторить
+            task.add_done_callback(lambda done: self._tasks.pop(key, None) if done.cancelled() or done.exception() is not None else None)
+        else:
+            self.reused += 1
+        return await asyncio.shield(task)
+
+    async def content(self, url: str, load: Callable[[], Awaitable]):
+        return await self.run_once(('content', normalize_url(url)), load)
+
+    async def summary(self, url: str, query: str, summarize: Callable[[], Awaitable]):
+        return await self.run_once(('summary', normalize_url(url), query), summarize)
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from http_client import get_session, http_timeout
+from resilience import call_with_retry
+from urls import normalize_url
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+SEARXNG_SEARCH_URL = os.getenv("SEARXNG_SEARCH_URL", "http://localhost:8080/search")
+SEARXNG_READ_TIMEOUT = float(os.getenv("SEARXNG_READ_TIMEOUT", 30))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", os.path.join(CACHE_DIR, "search.sqlite"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 24 * 60 * 60))
+# Константа reciprocal rank fusion: чем больше, тем меньше разница между соседними позициями
+RRF_K = int(os.getenv("RRF_K", 60))
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class SearchCache:
+    """Кэш поисковой выдачи SearXNG с ttl по нормализованному запросу. Хранится вся выдача, а не только max_results."""
+
+    def __init__(self, path: str, ttl: int):
+        self.ttl = ttl
+        self.counters = Counter(hits=0, misses=0)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS searches (
+                query TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    def get(self, query: str) -> list[dict] | None:
+        with self._lock:
+            row = self._db.execute("SELECT results, fetched_at FROM searches WHERE query = ?", (query,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            self.counters['misses'] += 1
+            return None
+        self.counters['hits'] += 1
+        return json.loads(row[0])
+
+    def put(self, query: str, results: list[dict]):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO searches(query, results, fetched_at) VALUES (?, ?, ?)",
+                (query, json.dumps(results, ensure_ascii=False), now)
+            )
+            self._db.execute("DELETE FROM searches WHERE fetched_at < ?", (now - self.ttl,))
+            self._db.commit()
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+search_cache = SearchCache(SEARCH_CACHE_PATH, SEARCH_CACHE_TTL)
+in_flight: dict[str, asyncio.Task] = {}
+
+
+async def fetch_searxng(query: str) -> list[dict]:
+    async def search():
+        async with get_session().get(SEARXNG_SEARCH_URL, params={'q': query, 'format': 'json'}, timeout=http_timeout(read=SEARXNG_READ_TIMEOUT)) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    response = await call_with_retry("searxng", search)
+    results = response['results']
+    # Пустая выдача или выдача без части движков обычно значит, что движки уперлись в лимиты,
+    # такой ответ не кэшируем, чтобы не остаться без выдачи по запросу на весь SEARCH_CACHE_TTL
+    unresponsive = response.get('unresponsive_engines') or []
+    if len(results) > 0 and len(unresponsive) == 0:
+        await asyncio.to_thread(search_cache.put, query, results)
+    elif len(unresponsive) > 0:
+        print(f"SearXNG engines did not respond for '{query}': {unresponsive}")
+    return results
+
+
+async def searxng_search(keywords: str, max_results: int) -> list[dict]:
+    """Выдача SearXNG из кэша или из сервиса. Одинаковые запросы, идущие одновременно, выполняются один раз."""
+    query = normalize_query(keywords)
+    results = await asyncio.to_thread(search_cache.get, query)
+    if results is None:
+        if query not in in_flight:
+            task = asyncio.create_task(fetch_searxng(query))
+            in_flight[query] = task
+            task.add_done_callback(lambda _: in_flight.pop(query, None))
+        results = await asyncio.shield(in_flight[query])
+    return results[:max_results]
+
+
+def assign_results(results: list[list[dict]], max_results: int) -> list[list[dict]]:
+    """Распределяет выдачу нескольких запросов так, чтобы каждый url достался одному запросу:
+    тому, в выдаче которого он стоит выше (при равенстве более раннему), а если у этого запроса уже набралось
+    max_results url - следующему по позиции запросу, в выдаче которого он есть.
+    Url запроса упорядочиваются по reciprocal rank fusion по всем запросам (сумма 1 / (RRF_K + позиция)),
+    так что страницы, найденные сразу несколькими вопросами, посещаются первыми."""
+    fused = Counter()
+    candidates = []
+    for query_index, query_results in enumerate(results):
+        for rank, result in enumerate(query_results):
+            key = normalize_url(result['url'])
+            fused[key] += 1 / (RRF_K + rank + 1)
+            candidates.append((rank, query_index, key, result))
+
+    own = [{} for _ in results]
+    assigned_keys = set()
+    for rank, query_index, key, result in sorted(candidates, key=lambda candidate: candidate[:2]):
+        if key not in assigned_keys and len(own[query_index]) < max_results:
+            own[query_index][key] = result
+            assigned_keys.add(key)
+
+    return [[query_own[key] for key in sorted(query_own, key=lambda key: -fused[key])] for query_own in own]
+
+
+async def search_many(queries: list[str], max_results: int) -> list[list[dict] | None]:
+    """Выдача по нескольким запросам параллельно. Каждый url попадает в выдачу только одного запроса,
+    поэтому пересекающиеся вопросы не посещают и не суммаризируют одни и те же страницы.
+    Берется вдвое больше результатов, чтобы у запросов оставалась выдача после удаления повторов.
+    Для упавшего запроса возвращается None, остальные запросы от него не зависят."""
+    results = await asyncio.gather(*[searxng_search(query, max_results * 2) for query in queries], return_exceptions=True)
+    failed = set()
+    for i, (query, result) in enumerate(zip(queries, results)):
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        if isinstance(result, BaseException):
+            print(f"Search failed for '{query}': {type(result).__name__}: {str(result)}")
+            failed.add(i)
+    assigned = assign_results([[] if i in failed else result for i, result in enumerate(results)], max_results)
+    return [None if i in failed else result for i, result in enumerate(assigned)]
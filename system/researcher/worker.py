@@ -0,0 +1,96 @@
+import asyncio
+import multiprocessing
+import os
+import socket
+import time
+from multiprocessing.connection import wait
+
+import bootstrap
+from job_queue import job_queue, Job
+from research import write_research
+from structured_outputs import ResearchRequest
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", 2))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 2))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", 60))
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", 5))
+
+
+async def run_job(job: Job):
+    request = ResearchRequest.model_validate(job.params)
+    print(f"Job {job.job_id} started, run_id={job.run_id}")
+
+    # progress вызывается синхронно из исследования, поэтому только запоминает значение,
+    # а в sqlite его пишет задача heartbeat вне event loop, схлопывая частые обновления
+    latest = {'progress': None, 'desc': None}
+    updated = asyncio.Event()
+
+    def progress(value, desc=None):
+        latest.update(progress=value, desc=desc)
+        updated.set()
+
+    async def on_chapter(chapter):
+        await asyncio.to_thread(job_queue.add_chapter, job.job_id, chapter)
+
+    async def heartbeat():
+        # Поиск по одному вопросу может идти дольше JOB_STALE_AFTER, поэтому heartbeat идет и без прогресса
+        while True:
+            try:
+                await asyncio.wait_for(updated.wait(), JOB_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            updated.clear()
+            await asyncio.to_thread(job_queue.heartbeat, job.job_id, latest['progress'], latest['desc'])
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    try:
+        result = await write_research(request.table_of_concepts, request.breadth_of_research, request.depth_of_research,
+                                      request.relevancy_pass_rate, request.num_search_urls, request.num_search_arxiv,
+                                      progress, job.run_id, on_chapter)
+        await asyncio.to_thread(job_queue.finish, job.job_id, result)
+        print(f"Job {job.job_id} done")
+    except Exception as e:
+        print(f"Job {job.job_id} failed: {type(e).__name__}: {str(e)}")
+        await asyncio.to_thread(job_queue.fail, job.job_id, f"{type(e).__name__}: {str(e)}")
+    finally:
+        heartbeat_task.cancel()
+
+
+async def work(worker: str):
+    print(f"Worker {worker} started")
+    while True:
+        job = await asyncio.to_thread(job_queue.claim, worker)
+        if job is None:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            continue
+        await run_job(job)
+
+
+def worker_main(worker: str):
+    bootstrap.configure()
+    asyncio.run(work(worker))
+
+
+if __name__ == "__main__":
+    # Каждый процесс берет по одной задаче, так что одновременно идет не больше WORKER_PROCESSES исследований
+    names = [f"{socket.gethostname()}-{os.getpid()}-{i}" for i in range(WORKER_PROCESSES)]
+    if WORKER_PROCESSES == 1:
+        worker_main(names[0])
+    else:
+        context = multiprocessing.get_context("spawn")
+
+        def start(name):
+            process = context.Process(target=worker_main, args=(name,), daemon=True)
+            process.start()
+            return process
+
+        processes = {name: start(name) for name in names}
+        # Упавший процесс перезапускается, иначе пул воркеров со временем пустеет.
+        # Его задачу другие воркеры вернут в очередь по JOB_STALE_AFTER
+        while True:
+            wait([process.sentinel for process in processes.values()])
+            time.sleep(WORKER_RESTART_DELAY)
+            for name, process in processes.items():
+                if not process.is_alive():
+                    print(f"Worker {name} exited with code {process.exitcode}, restarting")
+                    processes[name] = start(name)